@@ -18,6 +18,11 @@ setup(name='sparkey-python',
       install_requires=[
         "future==1.0.0"
       ],
+      extras_require={
+        "numpy": ["numpy"],
+        "arrow": ["pyarrow"],
+        "test": ["nose", "numpy", "pyarrow"],
+      },
       classifiers=[
           'Topic :: Database',
           'Intended Audience :: Developers',
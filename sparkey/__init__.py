@@ -17,10 +17,51 @@
 
 from builtins import object
 import ctypes
-import ctypes.util
+import os
+import sys
+import threading
+import weakref
 import future
 
-libsparkey = ctypes.cdll.LoadLibrary(ctypes.util.find_library("sparkey"))
+from sparkey.cache import LRUCache, MISSING as _MISSING
+from sparkey.stats import Stats, clock_ns as _clock_ns
+
+# libsparkey is loaded on first use rather than at import time, see
+# load_library().
+_libsparkey = None
+_libsparkey_lock = threading.Lock()
+
+# All open HashReaders, see after_fork().
+_hash_readers = weakref.WeakSet()
+
+# Idle native iterators kept by each HashReader.
+_ITER_POOL_SIZE = 4
+
+
+def after_fork():
+    """Resets per-process state in the child after a fork.
+
+    Hash readers opened before the fork keep sharing their memory mapped
+    files with the parent, but get fresh native iterator state, locks
+    and stats in the child. Readers and writers must not be used in the
+    child before this has been called.
+
+    On Python 3.7+ this is called automatically after os.fork() and
+    anything built on it (multiprocessing, prefork servers). It only
+    needs to be called explicitly on older versions, or after forking
+    through other means.
+
+    """
+    global _libsparkey_lock
+    # A fork while another thread held the lock would otherwise leave the
+    # child unable to ever load the library.
+    _libsparkey_lock = threading.Lock()
+    for reader in list(_hash_readers):
+        reader._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=after_fork)
 
 
 # Some constants
@@ -45,15 +86,69 @@ class SparkeyException(Exception):
     pass
 
 
-def _format(func, ret, *args):
+def load_library(path=None):
+    """Loads libsparkey, unless it has already been loaded.
+
+    This is done implicitly the first time any native function is used,
+    so calling it is only needed to control where the library comes
+    from, or to pay the loading cost up front, e.g. in a master process
+    before forking workers that then share the already loaded library.
+
+    The library is looked up in this order:
+        - the path argument
+        - the SPARKEY_LIBRARY environment variable
+        - ctypes.util.find_library("sparkey")
+
+    @param path: path or name of the shared library to load.
+
+    @returns: the loaded ctypes library.
+
+    @raise SparkeyException: if the library can not be found, or if a
+                             different library has already been loaded.
+
+    """
+    global _libsparkey
+    with _libsparkey_lock:
+        if _libsparkey is not None:
+            if path is not None and path != _libsparkey._name:
+                raise SparkeyException("libsparkey already loaded from %s" %
+                                       _libsparkey._name)
+            return _libsparkey
+        if path is None:
+            path = os.environ.get("SPARKEY_LIBRARY")
+        if path is None:
+            # find_library may spawn subprocesses, so it is only used as a
+            # last resort.
+            from ctypes.util import find_library
+            path = find_library("sparkey")
+        if path is None:
+            raise SparkeyException("Could not find libsparkey, set "
+                                   "SPARKEY_LIBRARY or call "
+                                   "sparkey.load_library(path)")
+        try:
+            _libsparkey = ctypes.cdll.LoadLibrary(path)
+        except OSError as e:
+            raise SparkeyException("Could not load libsparkey from %s: %s" %
+                                   (path, e))
+        return _libsparkey
+
+
+def __getattr__(name):
+    # sparkey.libsparkey used to be loaded at import time. It still works
+    # on Python 3.7+, where it loads the library on first access.
+    if name == "libsparkey":
+        return load_library()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def _bind(symbol, ret, args):
+    func = getattr(load_library(), symbol)
     func.restype = ret
     func.argtypes = tuple(args)
     return func
 
 
-def _ctypes_wrapper(func, ret, *args):
-    fn = _format(func, ret, *args)
-
+def _checked(fn):
     def wrapper(*a, **kw):
         code = fn(*a, **kw)
         if code != 0:
@@ -61,6 +156,50 @@ def _ctypes_wrapper(func, ret, *args):
     return wrapper
 
 
+def _lazy(symbol, factory):
+    # Native functions are bound to module globals named after the symbol,
+    # e.g. sparkey_hash_get becomes _hash_get. The first call binds the
+    # symbol and replaces the global, so later calls go straight to ctypes.
+    name = "_" + symbol[len("sparkey_"):]
+    bound = []
+
+    def bind():
+        if not bound:
+            bound.append(factory())
+            globals()[name] = bound[0]
+        return bound[0]
+
+    def stub(*a, **kw):
+        return bind()(*a, **kw)
+    stub.bind = bind
+    return stub
+
+
+def _native(name):
+    """Returns the bound native function for a global such as _hash_get.
+
+    Useful to avoid going through the lazy stub in tight loops outside
+    this module.
+
+    """
+    fn = globals()[name]
+    bind = getattr(fn, "bind", None)
+    return fn if bind is None else bind()
+
+
+def _format_api(func, ret, *args):
+    func.restype = ret
+    func.argtypes = tuple(args)
+    return func
+
+
+def _format(symbol, ret, *args):
+    return _lazy(symbol, lambda: _bind(symbol, ret, args))
+
+
+def _ctypes_wrapper(symbol, ret, *args):
+    return _lazy(symbol, lambda: _checked(_bind(symbol, ret, args)))
+
 
 _ptr = ctypes.c_void_p
 _str = ctypes.c_char_p
@@ -68,65 +207,76 @@ _byref = ctypes.byref
 _create_string_buffer = ctypes.create_string_buffer
 _c_ulonglong = ctypes.c_ulonglong
 
-_errstring = _format(libsparkey.sparkey_errstring, _str, ctypes.c_int)
+_errstring = _format("sparkey_errstring", _str, ctypes.c_int)
 
-_logwriter_create = _ctypes_wrapper(libsparkey.sparkey_logwriter_create,
+_logwriter_create = _ctypes_wrapper("sparkey_logwriter_create",
                                     ctypes.c_int, _ptr, _str, ctypes.c_int,
                                     ctypes.c_int)
-_logwriter_append = _ctypes_wrapper(libsparkey.sparkey_logwriter_append,
+_logwriter_append = _ctypes_wrapper("sparkey_logwriter_append",
                                     ctypes.c_int, _ptr, _str)
-_logwriter_close = _ctypes_wrapper(libsparkey.sparkey_logwriter_close,
+_logwriter_close = _ctypes_wrapper("sparkey_logwriter_close",
                                    ctypes.c_int, _ptr)
-_logwriter_flush = _ctypes_wrapper(libsparkey.sparkey_logwriter_flush,
+_logwriter_flush = _ctypes_wrapper("sparkey_logwriter_flush",
                                    ctypes.c_int, _ptr)
-_logwriter_put = _ctypes_wrapper(libsparkey.sparkey_logwriter_put,
-                                 ctypes.c_int, _ptr, _c_ulonglong, _str,
-                                 _c_ulonglong, _str)
-_logwriter_delete = _ctypes_wrapper(libsparkey.sparkey_logwriter_delete,
-                                    ctypes.c_int, _ptr, _c_ulonglong, _str)
-
-_logreader_open = _ctypes_wrapper(libsparkey.sparkey_logreader_open,
+# Keys and values are passed as void pointers, which accepts bytes as well
+# as ctypes arrays and raw addresses.
+_logwriter_put = _ctypes_wrapper("sparkey_logwriter_put",
+                                 ctypes.c_int, _ptr, _c_ulonglong, _ptr,
+                                 _c_ulonglong, _ptr)
+_logwriter_delete = _ctypes_wrapper("sparkey_logwriter_delete",
+                                    ctypes.c_int, _ptr, _c_ulonglong, _ptr)
+
+_logreader_open = _ctypes_wrapper("sparkey_logreader_open",
                                   ctypes.c_int, _ptr, _str)
-_logreader_close = _format(libsparkey.sparkey_logreader_close, None, _ptr)
-
-_logiter_close = _format(libsparkey.sparkey_logiter_close, None, _ptr)
-_logiter_create = _ctypes_wrapper(libsparkey.sparkey_logiter_create,
+_logreader_close = _format("sparkey_logreader_close", None, _ptr)
+_logreader_get_compression_type = _format(
+    "sparkey_logreader_get_compression_type", ctypes.c_int, _ptr)
+_logreader_get_compression_blocksize = _format(
+    "sparkey_logreader_get_compression_blocksize", ctypes.c_int, _ptr)
+
+_logiter_close = _format("sparkey_logiter_close", None, _ptr)
+_logiter_create = _ctypes_wrapper("sparkey_logiter_create",
                                   ctypes.c_int, _ptr, _ptr)
-_logiter_next = _ctypes_wrapper(libsparkey.sparkey_logiter_next, ctypes.c_int,
+_logiter_next = _ctypes_wrapper("sparkey_logiter_next", ctypes.c_int,
                                 _ptr, _ptr)
-_logiter_state = _format(libsparkey.sparkey_logiter_state,
+# Rewinds to the start of the current entry, not of the log.
+_logiter_reset = _ctypes_wrapper("sparkey_logiter_reset", ctypes.c_int,
+                                 _ptr, _ptr)
+_logiter_state = _format("sparkey_logiter_state",
                          ctypes.c_int, _ptr)
-_logiter_type = _format(libsparkey.sparkey_logiter_type, ctypes.c_int, _ptr)
-_logiter_keylen = _format(libsparkey.sparkey_logiter_keylen, _c_ulonglong, _ptr)
-_logiter_valuelen = _format(libsparkey.sparkey_logiter_valuelen,
+_logiter_type = _format("sparkey_logiter_type", ctypes.c_int, _ptr)
+_logiter_keylen = _format("sparkey_logiter_keylen", _c_ulonglong, _ptr)
+_logiter_valuelen = _format("sparkey_logiter_valuelen",
                             _c_ulonglong, _ptr)
-_logiter_fill_key = _ctypes_wrapper(libsparkey.sparkey_logiter_fill_key,
+_logiter_fill_key = _ctypes_wrapper("sparkey_logiter_fill_key",
                                     ctypes.c_int, _ptr, _ptr, _c_ulonglong,
-                                    _str, ctypes.POINTER(_c_ulonglong))
-_logiter_fill_value = _ctypes_wrapper(libsparkey.sparkey_logiter_fill_value,
+                                    _ptr, ctypes.POINTER(_c_ulonglong))
+_logiter_fill_value = _ctypes_wrapper("sparkey_logiter_fill_value",
                                       ctypes.c_int, _ptr, _ptr, _c_ulonglong,
-                                      _str, ctypes.POINTER(_c_ulonglong))
+                                      _ptr, ctypes.POINTER(_c_ulonglong))
 
-_hash_write = _ctypes_wrapper(libsparkey.sparkey_hash_write, ctypes.c_int,
+_hash_write = _ctypes_wrapper("sparkey_hash_write", ctypes.c_int,
                               _str, _str, ctypes.c_int)
 
-_hash_open = _ctypes_wrapper(libsparkey.sparkey_hash_open, ctypes.c_int, _ptr,
+_hash_open = _ctypes_wrapper("sparkey_hash_open", ctypes.c_int, _ptr,
                              _str, _str)
-_hash_close = _format(libsparkey.sparkey_hash_close, None, _ptr)
-_hash_getreader = _format(libsparkey.sparkey_hash_getreader, _ptr,
+_hash_close = _format("sparkey_hash_close", None, _ptr)
+_hash_getreader = _format("sparkey_hash_getreader", _ptr,
                           _ptr)
-_logiter_hashnext = _ctypes_wrapper(libsparkey.sparkey_logiter_hashnext,
+_logiter_hashnext = _ctypes_wrapper("sparkey_logiter_hashnext",
                                     ctypes.c_int, _ptr, _ptr)
-_hash_get = _ctypes_wrapper(libsparkey.sparkey_hash_get, ctypes.c_int, _ptr,
-                            _str, _c_ulonglong, _ptr)
-_hash_numentries = _format(libsparkey.sparkey_hash_numentries,
+_hash_get = _ctypes_wrapper("sparkey_hash_get", ctypes.c_int, _ptr,
+                            _ptr, _c_ulonglong, _ptr)
+_hash_numentries = _format("sparkey_hash_numentries",
                            _c_ulonglong, _ptr)
+_hash_numcollisions = _format("sparkey_hash_numcollisions",
+                              _c_ulonglong, _ptr)
 
 if str == bytes:
     def _to_bytes(s, name):
         t = type(s)
         if t != str and t != future.types.newstr:
-            raise SparkeyException(name + " must be a string")
+            return _buffer_to_bytes(s, name)
         return s
     
     def _to_str(b, name):
@@ -140,9 +290,10 @@ else:
         t = type(s)
         if t == bytes:
             return s
-        if t != str:
-            raise SparkeyException(name + " must be a string")
-        return s.encode('utf-8')
+        if t == str or isinstance(s, str):
+            # Subclasses such as numpy.str_ expose their UCS-4 buffer.
+            return s.encode('utf-8')
+        return _buffer_to_bytes(s, name)
 
     def _to_str(b, name):
         if b is None: return None
@@ -153,9 +304,150 @@ else:
             raise SparkeyException(name + " must be bytes")
         return b.decode('utf-8')
 
-class LogWriter(object):
+
+_text_types = (str, future.types.newstr) if str == bytes else (str,)
+
+
+def _memoryview(s, name):
+    try:
+        view = memoryview(s)
+    except TypeError:
+        raise SparkeyException(name + " must be a string or a buffer")
+    if not view.c_contiguous:
+        raise SparkeyException(name + " must be a contiguous buffer")
+    return view
+
+
+def _buffer_to_bytes(s, name):
+    return _memoryview(s, name).tobytes()
+
+
+class _Py_buffer(ctypes.Structure):
+    _fields_ = [("buf", ctypes.c_void_p),
+                ("obj", ctypes.c_void_p),
+                ("len", ctypes.c_ssize_t),
+                ("itemsize", ctypes.c_ssize_t),
+                ("readonly", ctypes.c_int),
+                ("ndim", ctypes.c_int),
+                ("format", ctypes.c_char_p),
+                ("shape", ctypes.c_void_p),
+                ("strides", ctypes.c_void_p),
+                ("suboffsets", ctypes.c_void_p),
+                ("internal", ctypes.c_void_p)]
+
+
+try:
+    _PyObject_GetBuffer = _format_api(ctypes.pythonapi.PyObject_GetBuffer,
+                                      ctypes.c_int, ctypes.py_object,
+                                      ctypes.POINTER(_Py_buffer),
+                                      ctypes.c_int)
+    _PyBuffer_Release = _format_api(ctypes.pythonapi.PyBuffer_Release, None,
+                                    ctypes.POINTER(_Py_buffer))
+except AttributeError:
+    # Not CPython, buffers are copied instead.
+    _PyObject_GetBuffer = None
+
+
+class _PinnedBuffer(object):
+    """Holds on to the memory of a buffer object, without copying it, for
+    as long as this object is alive. Can be passed as a void pointer."""
+
+    def __init__(self, view):
+        buf = _Py_buffer()
+        _PyObject_GetBuffer(view, _byref(buf), 0)
+        self._buf = buf
+        self._as_parameter_ = buf.buf
+        self.len = buf.len
+
+    def __del__(self):
+        _PyBuffer_Release(_byref(self._buf))
+
+
+def _to_buffer(s, name):
+    """Converts a key or value to a pointer argument and a length.
+
+    bytes are passed as is and strings are encoded as UTF-8. Any other
+    object supporting the buffer protocol (bytearray, memoryview, mmap,
+    NumPy arrays, ...) is passed by address without being copied, as long
+    as it is C-contiguous.
+
+    """
+    t = type(s)
+    if t is bytes:
+        return s, len(s)
+    if t is str or isinstance(s, _text_types):
+        s = _to_bytes(s, name)
+        return s, len(s)
+    view = _memoryview(s, name)
+    if _PyObject_GetBuffer is None:
+        s = view.tobytes()
+        return s, len(s)
+    pinned = _PinnedBuffer(view)
+    return pinned, pinned.len
+
+
+class _Closeable(object):
+    """Closes the object at the end of a with block."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _Observable(_Closeable):
+    """Support for observers, see L{add_observer}.
+
+    Instances with observers are switched to an instrumented subclass,
+    so instances without any pay nothing for this.
+
+    """
+    _observers = ()
+    _stats = None
+
+    def add_observer(self, observer):
+        """Registers an observer of all operations on this object.
+
+        @param observer: an object with a method
+                         C{observe(op, key, value, elapsed_ns)}, for
+                         instance a L{Stats}.
+
+        """
+        self._observers = list(self._observers) + [observer]
+        if not isinstance(self, _Observed):
+            self.__class__ = _observed_class(type(self))
+
+    def remove_observer(self, observer):
+        """Unregisters an observer added with L{add_observer}."""
+        observers = list(self._observers)
+        observers.remove(observer)
+        self._observers = observers
+        if not observers and isinstance(self, _Observed):
+            self.__class__ = self._unobserved
+
+    def _init_stats(self, stats):
+        if stats is True:
+            stats = Stats()
+        self._stats = stats
+        self.add_observer(stats)
+
+    def stats(self):
+        """Returns a snapshot of the collected stats.
+
+        @returns: a dict as returned by L{Stats.snapshot}, or None if this
+                  object was not created with stats enabled.
+
+        """
+        if self._stats is None:
+            return None
+        return self._stats.snapshot()
+
+
+class LogWriter(_Observable):
     def __init__(self, filename, mode='NEW',
-                 compression_type=Compression.NONE, compression_block_size=0):
+                 compression_type=Compression.NONE, compression_block_size=0,
+                 stats=None):
         """Creates or appends a log file.
         
         Types of keys and values can be strings or bytes.
@@ -188,10 +480,16 @@ class LogWriter(object):
                To get good compression and performance, this should be a
                fairly small multiple of expected key + value size.
 
+        @param stats: True or a L{Stats} object to collect stats about
+                      all operations, see L{stats}.
+
         """
         filename = _to_bytes(filename, "filename")
         log = _ptr()
         self._log = log
+        self._filename = filename
+        # A new file's directory entry must be synced once as well.
+        self._dir_synced = mode != 'NEW'
         if mode == 'NEW':
             _logwriter_create(_byref(log), filename,
                               compression_type,
@@ -201,6 +499,8 @@ class LogWriter(object):
         else:
             raise SparkeyException("Invalid mode %s, expected 'NEW' or "
                                    "'APPEND'" % (mode))
+        if stats:
+            self._init_stats(stats)
 
     def __del__(self):
         self.close()
@@ -220,10 +520,20 @@ class LogWriter(object):
         if self._log is None:
             raise SparkeyException("Writer is closed")
 
-    def flush(self):
-        """Flushes all pending changes from memory to file."""
+    def flush(self, fsync=False):
+        """Flushes all pending changes from memory to file.
+
+        @param fsync: if True, also waits until the changes are on stable
+                      storage, so they survive a crash of the machine.
+
+        """
         self._assert_open()
         _logwriter_flush(self._log)
+        if fsync:
+            _fsync(self._filename)
+            if not self._dir_synced:
+                _fsync_dir(self._filename)
+                self._dir_synced = True
 
     def __setitem__(self, key, value):
         """Equivalent to put(key, value)"""
@@ -232,14 +542,14 @@ class LogWriter(object):
     def put(self, key, value):
         """Append the key-value pair to the log.
 
-        @param key: type must be bytes or string
-        @param value: type must be bytes or string
+        @param key: type must be bytes, string or a contiguous buffer
+        @param value: type must be bytes, string or a contiguous buffer
         
         """
         self._assert_open()
-        key = _to_bytes(key, "key")
-        value = _to_bytes(value, "value")
-        _logwriter_put(self._log, len(key), key, len(value), value)
+        key, keylen = _to_buffer(key, "key")
+        value, valuelen = _to_buffer(value, "value")
+        _logwriter_put(self._log, keylen, key, valuelen, value)
 
     def __delitem__(self, key):
         """del writer[key] is equivalent to delete(key) (see L{delete})"""
@@ -248,25 +558,30 @@ class LogWriter(object):
     def delete(self, key):
         """Appends a delete operation of key to the log.
 
-        @param key: type must be bytes or string
+        @param key: type must be bytes, string or a contiguous buffer
 
         """
         self._assert_open()
-        key = _to_bytes(key, "key")
-        _logwriter_delete(self._log, len(key), key)
+        key, keylen = _to_buffer(key, "key")
+        _logwriter_delete(self._log, keylen, key)
 
 
-class LogReader(object):
-    def __init__(self, filename):
+class LogReader(_Observable):
+    def __init__(self, filename, stats=None):
         """Opens a file for log iteration.
 
         @param filename: file to open.
 
+        @param stats: True or a L{Stats} object to collect stats about
+                      all operations, see L{stats}.
+
         """
         filename = _to_bytes(filename, "filename")
         log = _ptr()
         self._log = log
         _logreader_open(_byref(log), filename)
+        if stats:
+            self._init_stats(stats)
 
     def __del__(self):
         self.close()
@@ -291,6 +606,26 @@ class LogReader(object):
             raise SparkeyException("Reader is closed")
 
 
+def _fsync(filename):
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_dir(filename):
+    if not hasattr(os, "O_DIRECTORY"):
+        # Directories can not be opened on Windows, nor need syncing.
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(filename)),
+                 os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
 def _iter_res(iterator, log):
     state = _logiter_state(iterator)
 
@@ -318,7 +653,7 @@ def _iter_res(iterator, log):
     return key, value, type_
 
 
-class LogIter(object):
+class LogIter(_Closeable):
     def __init__(self, logreader):
         """Internal function.
 
@@ -384,10 +719,11 @@ def writehash(hashfile, logfile, hash_size=0):
     _hash_write(hashfile, logfile, hash_size)
 
 
-class HashReader(object):
+class HashReader(_Observable):
     """This is a reader that supports both iteration and random lookups."""
 
-    def __init__(self, hashfile, logfile):
+    def __init__(self, hashfile, logfile, stats=None, cache_size=0,
+                 pin=None):
         """Opens a hash file and log file for reading.
 
         @param hashfile: Hash file to open, must exist and be
@@ -395,14 +731,68 @@ class HashReader(object):
 
         @param logfile: Log file to open, must exist.
 
+        @param stats: True or a L{Stats} object to collect stats about
+                      all operations, see L{stats}.
+
+        @param cache_size: if non-zero, the results of lookups are cached
+                           in memory, using at most this many bytes. This
+                           is mostly useful for Snappy compressed logs,
+                           where each lookup decompresses a whole block.
+                           See L{cache_info}.
+
+        @param pin: 'index' to lock the hash file in memory, so lookups do
+                    not wait for disk reads after the pages have been
+                    evicted, or 'all' to lock the log file as well. If
+                    the RLIMIT_MEMLOCK limit does not allow it, the files
+                    are only read into the page cache. See L{pin_info}.
+
         """
+        if pin not in (None, "index", "all"):
+            raise SparkeyException("pin must be None, 'index' or 'all'")
+        pinned = (hashfile,) if pin == "index" else (hashfile, logfile)
         hashfile = _to_bytes(hashfile, "hashfile")
         logfile = _to_bytes(logfile, "logfile")
         reader = _ptr()
         self._reader = reader
         self._iter = None
+        self._pinned = []
+        self._iter_pool = []
+        # The first live key in log order, used to rewind pooled native
+        # iterators. None if there are no live keys.
+        self._first_key = _MISSING
+        self._cache = LRUCache(cache_size) if cache_size else None
         _hash_open(_byref(reader), hashfile, logfile)
         self._iter = HashIterator(self)
+        if pin:
+            self._pin(pinned)
+        if stats:
+            self._init_stats(stats)
+        _hash_readers.add(self)
+
+    def _after_fork(self):
+        if self._reader is None:
+            return
+        # The native iterator may have been in use by another thread of
+        # the parent, so it can not be trusted in the child. It is leaked
+        # rather than closed or pooled. Pooled iterators were idle.
+        if self._iter is not None:
+            self._iter._iter = None
+        self._iter = HashIterator(self)
+        for pinned in self._pinned:
+            pinned.after_fork()
+        if self._cache is not None:
+            self._cache.after_fork()
+        if self._stats is not None:
+            self._stats.reset()
+
+    def _pin(self, files):
+        from sparkey.pin import PinnedFile
+        try:
+            for filename in files:
+                self._pinned.append(PinnedFile(filename))
+        except OSError as e:
+            self.close()
+            raise SparkeyException("Could not pin %s: %s" % (filename, e))
 
     def __del__(self):
         self.close()
@@ -414,10 +804,57 @@ class HashReader(object):
             _hash_close(_byref(reader))
             self._reader = None
 
+        for pinned in getattr(self, "_pinned", ()):
+            pinned.close()
+        self._pinned = []
+
+        pool, self._iter_pool = getattr(self, "_iter_pool", []), []
+        for iterator, _ in pool:
+            _logiter_close(_byref(iterator))
+
+        # With the reader closed, this closes the native iterator rather
+        # than pooling it.
         if self._iter is not None:
             self._iter.close()
             self._iter = None
 
+    def _acquire_iter(self):
+        """Returns a native iterator positioned at the start of the log,
+        and whether it is parked on the first entry (see L{_release_iter})
+        rather than new."""
+        while True:
+            try:
+                iterator, fresh = self._iter_pool.pop()
+            except IndexError:
+                break
+            if fresh:
+                return iterator, False
+            key = self._first_key
+            if key is not None:
+                _hash_get(self._reader, key, len(key), iterator)
+                if _logiter_state(iterator) == IterState.ACTIVE:
+                    return iterator, True
+            _logiter_close(_byref(iterator))
+        iterator = _ptr()
+        _logiter_create(_byref(iterator), _hash_getreader(self._reader))
+        return iterator, False
+
+    def _release_iter(self, iterator, fresh):
+        """Returns a native iterator to the pool, or closes it.
+
+        Used iterators can only be rewound by looking up the first live
+        key, so they are only kept once that key is known. For a store
+        without live keys they are closed, since creating new ones is
+        just as cheap.
+
+        """
+        if (self._reader is not None
+                and len(self._iter_pool) < _ITER_POOL_SIZE
+                and (fresh or isinstance(self._first_key, bytes))):
+            self._iter_pool.append((iterator, fresh))
+        else:
+            _logiter_close(_byref(iterator))
+
     def __iter__(self):
         """Equivalent to L{iteritems}"""
         return self.iteritems()
@@ -425,6 +862,14 @@ class HashReader(object):
     def iteritems(self):
         """Iterate through all live entries.
 
+        Native iterators are pooled by the reader, so closing the
+        returned iterator, or using it in a with block, makes the next
+        call cheaper:
+
+            with reader.iteritems() as it:
+                for key, value in it:
+                    ...
+
         @returntype: L{HashIterator}
 
         """
@@ -448,10 +893,12 @@ class HashReader(object):
         return value
 
     def __contains__(self, key):
+        key, keylen = _to_buffer(key, "key")
         self._assert_open()
         iterator = self._iter._iter
+        self._iter._fresh = self._iter._rewound = False
 
-        _hash_get(self._reader, key, len(key), iterator)
+        _hash_get(self._reader, key, keylen, iterator)
 
         res = True
         state = _logiter_state(iterator)
@@ -465,7 +912,7 @@ class HashReader(object):
     def get(self, key):
         """Retrieve the value associated with the key
 
-        @param key: type must be bytes or string
+        @param key: type must be bytes, string or a contiguous buffer
 
         @returns: bytes representing the value associated with the key, or None if the
                   key does not exist.
@@ -475,7 +922,7 @@ class HashReader(object):
     def getAsString(self, key):
         """Retrieve the value associated with the key
 
-        @param key: type must be bytes or string
+        @param key: type must be bytes, string or a contiguous buffer
 
         @returns: a string representing the value associated with the key, or None if the
                   key does not exist.
@@ -485,23 +932,68 @@ class HashReader(object):
     def __len__(self):
         return _hash_numentries(self._reader)
 
+    def num_collisions(self):
+        """Returns the number of hash collisions in the hash file."""
+        self._assert_open()
+        return _hash_numcollisions(self._reader)
+
+    def compression_type(self):
+        """Returns the L{Compression} type of the log."""
+        self._assert_open()
+        return _logreader_get_compression_type(self._iter._log)
+
+    def compression_block_size(self):
+        """Returns the compression block size of the log."""
+        self._assert_open()
+        return _logreader_get_compression_blocksize(self._iter._log)
+
+    def pin_info(self):
+        """Returns how much of the store is held in memory.
+
+        @returns: a dict with the files pinned by this reader, each as
+                  returned by L{PinnedFile.info}, the bytes locked by
+                  this reader and by the whole process, and the
+                  RLIMIT_MEMLOCK limit (None if unlimited).
+
+        """
+        from sparkey import pin
+        files = [p.info() for p in self._pinned]
+        return {"files": files,
+                "locked_bytes": sum(f["bytes"] for f in files if f["locked"]),
+                "process_locked_bytes": pin.locked_bytes(),
+                "memlock_limit": pin.memlock_limit()}
+
+    def cache_info(self):
+        """Returns the size and hit rate of the lookup cache.
 
-class HashIterator(object):
+        @returns: a dict as returned by L{LRUCache.info}, or None if the
+                  reader was created without a cache_size.
+
+        """
+        if self._cache is None:
+            return None
+        return self._cache.info()
+
+
+class HashIterator(_Closeable):
     def __init__(self, hashreader):
         """Internal function: use iter(hashreader) instead."""
+        self._iter = None
         hashreader._assert_open()
-        self._iter = _ptr()
         self._log = _hash_getreader(hashreader._reader)
         self._hashreader = hashreader
-        _logiter_create(_byref(self._iter), self._log)
+        self._iter, self._rewound = hashreader._acquire_iter()
+        # True until the native iterator has moved.
+        self._fresh = not self._rewound
 
     def __del__(self):
         self.close()
 
     def close(self):
-        """Safely closes the iterator."""
+        """Safely closes the iterator, returning the native iterator to
+        the reader's pool."""
         if self._iter is not None:
-            _logiter_close(_byref(self._iter))
+            self._hashreader._release_iter(self._iter, self._fresh)
             self._hashreader = None
             self._log = None
             self._iter = None
@@ -520,11 +1012,23 @@ class HashIterator(object):
 
         """
         self._assert_open()
-        _logiter_hashnext(self._iter, self._hashreader._reader)
-        t = _iter_res(self._iter, self._log)
-        if t:
-            key, value, type = t
-            return key, value
+        if self._rewound:
+            # Parked on the first entry, with its key already read.
+            self._rewound = False
+            _logiter_reset(self._iter, self._log)
+        else:
+            _logiter_hashnext(self._iter, self._hashreader._reader)
+        first = self._fresh
+        self._fresh = False
+        try:
+            key, value, type = _iter_res(self._iter, self._log)
+        except StopIteration:
+            if first:
+                self._hashreader._first_key = None
+            raise
+        if first:
+            self._hashreader._first_key = key
+        return key, value
 
     def __next__(self):
         return self.next()
@@ -543,18 +1047,30 @@ class HashIterator(object):
     def get(self, key):
         """Get the value associated with the key
 
-        @param key: type must be bytes or string
+        @param key: type must be bytes, string or a contiguous buffer
 
         @returns: bytes representing the value associated with the key, or None if the
                   key does not exist.
 
         """
-        key = _to_bytes(key,  "key")
         self._assert_open()
+        cache = self._hashreader._cache
+        if cache is None:
+            key, keylen = _to_buffer(key, "key")
+            return self._get(key, keylen)
+        key = _to_bytes(key, "key")
+        value = cache.get(key)
+        if value is _MISSING:
+            value = self._get(key, len(key))
+            cache.put(key, value)
+        return value
+
+    def _get(self, key, keylen):
         iterator = self._iter
         log = self._log
+        self._fresh = self._rewound = False
 
-        _hash_get(self._hashreader._reader, key, len(key), iterator)
+        _hash_get(self._hashreader._reader, key, keylen, iterator)
 
         state = _logiter_state(iterator)
         if state != IterState.ACTIVE:
@@ -576,7 +1092,7 @@ class HashIterator(object):
     def getAsString(self, key):
         """Retrieve the value associated with the key
 
-        @param key: type must be bytes or string
+        @param key: type must be bytes, string or a contiguous buffer
 
         @returns: a string representing the value associated with the key, or None if the
                   key does not exist.
@@ -585,10 +1101,14 @@ class HashIterator(object):
     
 
 
-class HashWriter(object):
+# Marks a key deleted in the HashWriter overlay.
+_DELETED = object()
+
+
+class HashWriter(_Observable):
     def __init__(self, hashfile, logfile, mode='NEW',
                  compression_type=Compression.NONE, compression_block_size=0,
-                 hash_size=0):
+                 hash_size=0, stats=None, overlay_limit=0):
         """Creates a new writer.
 
         Does everything that L{LogWriter} does, but also writes the
@@ -607,6 +1127,16 @@ class HashWriter(object):
         @param hash_size: Valid values are 0, 4, 8. 0 means autoselect
                           hash size . 4 is 32 bit hash, 8 is 64 bit hash.
 
+        @param stats: True or a L{Stats} object to collect stats about
+                      all operations, see L{stats}.
+
+        @param overlay_limit: if non-zero, puts and deletes are also kept
+                              in memory until the next flush, so that
+                              L{get} sees them right away. When the
+                              overlay uses more than this many bytes, a
+                              flush is started in the background (see
+                              L{flush_async}).
+
         """
         self._logwriter = LogWriter(logfile, mode, compression_type,
                                     compression_block_size)
@@ -614,6 +1144,17 @@ class HashWriter(object):
         self._logfile = logfile
         self._reader = None
         self._hash_size = hash_size
+        self._overlay_limit = overlay_limit
+        self._overlay = {}
+        self._overlay_bytes = 0
+        # In NEW mode, any hash file on disk belongs to an older log.
+        self._hashed = mode == 'APPEND'
+        # Background rebuild state, see flush_async.
+        self._executor = None
+        self._pending = None
+        self._flushing = None
+        if stats:
+            self._init_stats(stats)
 
     def _assert_open(self):
         if self._logwriter is None:
@@ -626,12 +1167,19 @@ class HashWriter(object):
     def put(self, k, v):
         """Append the key-value pair to the log.
 
-        @param key: type must be bytes or string
+        @param key: type must be bytes, string or a contiguous buffer
 
-        @param value: type must be bytes or string
+        @param value: type must be bytes, string or a contiguous buffer
 
         """
+        self._assert_open()
+        if not self._overlay_limit:
+            self._logwriter.put(k, v)
+            return
+        k = _to_bytes(k, "key")
+        v = _to_bytes(v, "value")
         self._logwriter.put(k, v)
+        self._overlay_set(k, v)
 
     def __delitem__(self, key):
         """Equivalent to writer.delete(key), see L{delete}"""
@@ -640,17 +1188,149 @@ class HashWriter(object):
     def delete(self, k):
         """Appends a delete operation of key to the log.
 
-        @param key: type must be bytes or string
+        @param key: type must be bytes, string or a contiguous buffer
 
         """
         self._assert_open()
+        if not self._overlay_limit:
+            self._logwriter.delete(k)
+            return
+        k = _to_bytes(k, "key")
         self._logwriter.delete(k)
+        self._overlay_set(k, _DELETED)
+
+    def _overlay_set(self, key, value):
+        overlay = self._overlay
+        old = overlay.get(key)
+        if old is not None:
+            self._overlay_bytes -= _overlay_entry_size(key, old)
+        overlay[key] = value
+        self._overlay_bytes += _overlay_entry_size(key, value)
+        if self._overlay_bytes > self._overlay_limit:
+            self.flush_async()
+
+    def overlay_bytes(self):
+        """Returns the approximate memory used by unflushed writes.
+
+        Always 0 unless the writer was created with an overlay_limit.
+        Writes covered by a running L{flush_async} are not included.
+
+        """
+        return self._overlay_bytes
+
+    def flush(self, fsync=False):
+        """Flushes all log writes, and also rebuilds the hash.
+
+        @param fsync: if True, also waits until the log and hash are on
+                      stable storage.
 
-    def flush(self):
-        """Flushes all log writes, and also rebuilds the hash."""
+        """
         self._assert_open()
-        self._logwriter.flush()
+        self._wait_pending()
+        self._logwriter.flush(fsync=fsync)
         writehash(self._hashfile, self._logfile, self._hash_size)
+        if fsync:
+            # The hash file is replaced by a rename.
+            _fsync(self._hashfile)
+            _fsync_dir(self._hashfile)
+        self._hashed = True
+        self._overlay = {}
+        self._overlay_bytes = 0
+        # The current reader, if any, still sees the old hash file.
+        self._close_reader()
+
+    def flush_log(self, fsync=False):
+        """Flushes all log writes, without rebuilding the hash.
+
+        The writes survive a crash once this returns, but only become
+        visible to readers of the hash file after the next L{flush} or
+        L{close}.
+
+        @param fsync: if True, also waits until the log is on stable
+                      storage.
+
+        """
+        self._assert_open()
+        # A background rebuild may still be opening the log.
+        self._wait_pending()
+        self._logwriter.flush(fsync=fsync)
+
+    def flush_async(self):
+        """Flushes all log writes, and rebuilds the hash in the background.
+
+        The hash is rebuilt on a worker thread (the native call releases
+        the GIL) while the caller keeps writing to the log. Once it is
+        done, L{get} and L{iteritems} switch to the new hash. With an
+        overlay, writes covered by the rebuild stay visible meanwhile.
+
+        Only one rebuild runs at a time: if the previous one has not
+        finished yet, this waits for it first.
+
+        @returns: a C{concurrent.futures.Future} that completes when the
+                  hash has been rebuilt.
+
+        """
+        self._assert_open()
+        self._wait_pending()
+        self._logwriter.flush()
+        if self._overlay_limit:
+            self._flushing = self._overlay
+            self._overlay = {}
+            self._overlay_bytes = 0
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = self._executor.submit(
+            _rebuild_hash, self._hashfile, self._logfile, self._hash_size)
+        return self._pending
+
+    def close_async(self):
+        """Closes the writer and rebuilds the hash in the background.
+
+        The writer can not be used after this call.
+
+        @returns: a C{concurrent.futures.Future} that completes when the
+                  hash has been rebuilt.
+
+        """
+        self._assert_open()
+        self._wait_pending()
+        self._logwriter.close()
+        executor = self._executor
+        if executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            executor = ThreadPoolExecutor(max_workers=1)
+        self._executor = None
+        future = executor.submit(writehash, self._hashfile, self._logfile,
+                                 self._hash_size)
+        executor.shutdown(wait=False)
+        self.destroy()
+        return future
+
+    def _wait_pending(self):
+        if self._pending is not None:
+            self._finish_pending()
+
+    def _finish_pending(self):
+        # Swaps in the reader built by flush_async. This always happens on
+        # the writer's own thread, so the old reader is never closed while
+        # a lookup is using it.
+        pending = self._pending
+        self._pending = None
+        flushing = self._flushing
+        self._flushing = None
+        try:
+            reader = pending.result()
+        except Exception:
+            if flushing is not None:
+                flushing.update(self._overlay)
+                self._overlay = flushing
+                self._overlay_bytes = sum(
+                    _overlay_entry_size(k, v) for k, v in flushing.items())
+            raise
+        self._close_reader()
+        self._reader = reader
+        self._hashed = True
 
     def __del__(self):
         self.destroy()
@@ -664,7 +1344,14 @@ class HashWriter(object):
         if self._logwriter is not None:
             self._logwriter.close()
             self._logwriter = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._pending = None
+        self._flushing = None
         self._close_reader()
+        self._overlay = {}
+        self._overlay_bytes = 0
         self._hashfile = None
         self._logfile = None
 
@@ -681,6 +1368,10 @@ class HashWriter(object):
             self.flush()
             self.destroy()
 
+    def finish_async(self):
+        """Equivalent to L{close_async}"""
+        return self.close_async()
+
     # Reader related code
     def _close_reader(self):
         if self._reader is not None:
@@ -688,6 +1379,9 @@ class HashWriter(object):
             self._reader = None
 
     def _init_reader(self):
+        pending = self._pending
+        if pending is not None and pending.done():
+            self._finish_pending()
         if self._reader is None:
             self._reader = HashReader(self._hashfile, self._logfile)
         return self._reader
@@ -707,32 +1401,146 @@ class HashWriter(object):
 
     def __getitem__(self, key):
         """Equivalent to writer.get(key), see L{get}"""
-        self._assert_open()
-        return self._init_reader().get(key)
+        return self.get(key)
 
     def get(self, key):
         """Performs a hash lookup of a key.
 
-        Only finds things that were flushed to the hash.
+        Only finds things that were flushed to the hash, unless the writer
+        was created with an overlay_limit, in which case unflushed writes
+        are seen too.
 
-        @param key: type must be bytes or string
+        @param key: type must be bytes, string or a contiguous buffer
 
         @returns: bytes representing the value associated with the key, or None if the
                   key does not exist in the hash.
 
         """
         self._assert_open()
+        if not self._overlay_limit:
+            return self._init_reader().get(key)
+        key = _to_bytes(key, "key")
+        value = self._overlay.get(key)
+        if value is None and self._flushing is not None:
+            value = self._flushing.get(key)
+        if value is not None:
+            return None if value is _DELETED else value
+        if not self._hashed:
+            pending = self._pending
+            if pending is None or not pending.done():
+                return None
         return self._init_reader().get(key)
 
     def getAsString(self, key):
         """Performs a hash lookup of a key.
 
-        Only finds things that were flushed to the hash.
+        Same as L{get}, but returns a string.
 
-        @param key: type must be bytes or string
+        @param key: type must be bytes, string or a contiguous buffer
 
         @returns: a string representing the value associated with the key, or None if the
                   key does not exist in the hash.
 
         """
         return _to_str(self.get(key), "value")
+
+
+def _rebuild_hash(hashfile, logfile, hash_size):
+    writehash(hashfile, logfile, hash_size)
+    return HashReader(hashfile, logfile)
+
+
+def _overlay_entry_size(key, value):
+    if value is _DELETED:
+        return sys.getsizeof(key)
+    return sys.getsizeof(key) + sys.getsizeof(value)
+
+
+# Instrumented variants of the classes above, used by
+# _Observable.add_observer.
+class _Observed(object):
+    def _observe(self, op, key, value, elapsed_ns):
+        for observer in self._observers:
+            observer.observe(op, key, value, elapsed_ns)
+
+    def _observe_iter(self, iterator):
+        iterator._observers = self._observers
+        iterator.__class__ = _observed_class(type(iterator))
+        return iterator
+
+
+class _ObservedLogWriter(_Observed):
+    def put(self, key, value):
+        start = _clock_ns()
+        super(_ObservedLogWriter, self).put(key, value)
+        self._observe("put", key, value, _clock_ns() - start)
+
+    def delete(self, key):
+        start = _clock_ns()
+        super(_ObservedLogWriter, self).delete(key)
+        self._observe("delete", key, None, _clock_ns() - start)
+
+    def flush(self, fsync=False):
+        start = _clock_ns()
+        super(_ObservedLogWriter, self).flush(fsync=fsync)
+        self._observe("flush", None, None, _clock_ns() - start)
+
+
+class _ObservedHashWriter(_ObservedLogWriter):
+    def get(self, key):
+        start = _clock_ns()
+        value = super(_ObservedHashWriter, self).get(key)
+        self._observe("get", key, value, _clock_ns() - start)
+        return value
+
+
+class _ObservedLogReader(_Observed):
+    def __iter__(self):
+        return self._observe_iter(super(_ObservedLogReader, self).__iter__())
+
+
+class _ObservedHashReader(_Observed):
+    def get(self, key):
+        start = _clock_ns()
+        value = super(_ObservedHashReader, self).get(key)
+        self._observe("get", key, value, _clock_ns() - start)
+        return value
+
+    def __contains__(self, key):
+        start = _clock_ns()
+        res = super(_ObservedHashReader, self).__contains__(key)
+        self._observe("contains", key, res, _clock_ns() - start)
+        return res
+
+    def iteritems(self):
+        return self._observe_iter(super(_ObservedHashReader, self).iteritems())
+
+
+class _ObservedIter(_Observed):
+    def next(self):
+        start = _clock_ns()
+        entry = super(_ObservedIter, self).next()
+        self._observe("next", entry[0], entry[1], _clock_ns() - start)
+        return entry
+
+
+_observer_mixins = {
+    LogWriter: _ObservedLogWriter,
+    HashWriter: _ObservedHashWriter,
+    LogReader: _ObservedLogReader,
+    HashReader: _ObservedHashReader,
+    LogIter: _ObservedIter,
+    HashIterator: _ObservedIter,
+}
+_observed_classes = {}
+
+
+def _observed_class(cls):
+    observed = _observed_classes.get(cls)
+    if observed is None:
+        mixin = next(_observer_mixins[base] for base in cls.__mro__
+                     if base in _observer_mixins)
+        observed = type("Observed" + cls.__name__, (mixin, cls),
+                        {"_unobserved": cls})
+        _observed_classes[cls] = observed
+    return observed
@@ -0,0 +1,420 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Command line tool for building, inspecting and exporting stores.
+
+    python -m sparkey build store.spi store.spl --input data.tsv
+    python -m sparkey get store.spi store.spl some-key
+    python -m sparkey mget store.spi store.spl < keys.txt
+    python -m sparkey dump store.spi store.spl --format jsonl > data.jsonl
+    python -m sparkey stats store.spi store.spl
+    python -m sparkey bench store.spi store.spl --lookups 1000000
+    python -m sparkey diff old.spi old.spl new.spi new.spl
+    python -m sparkey export store.spi store.spl snapshot.parquet
+
+Records are read and written in one of three formats:
+    - tsv: key<TAB>value per line, with backslash escapes for tab,
+      newline, carriage return and backslash.
+    - jsonl: one {"key": ..., "value": ...} object per line. Bytes that
+      are not valid UTF-8 are kept as surrogate escapes. In build input,
+      a null value deletes the key.
+    - binary: u32 key length, key, u32 value length, value, repeated,
+      with big-endian lengths.
+
+Keys given to mget on stdin are one per line, with the same escapes as
+tsv, so the first column of a tsv dump can be fed back in.
+
+All commands stream, so memory use does not depend on the store size.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import json
+import os
+import random
+import struct
+import sys
+
+import sparkey
+from sparkey.stats import Histogram, clock_ns
+
+FORMATS = ("tsv", "jsonl", "binary")
+_u32 = struct.Struct(">I")
+
+_ESCAPES = {b"\\": b"\\\\", b"\t": b"\\t", b"\n": b"\\n", b"\r": b"\\r"}
+_UNESCAPES = {b"\\": b"\\", b"t": b"\t", b"n": b"\n", b"r": b"\r"}
+
+
+def _escape(b):
+    if b"\\" in b:
+        b = b.replace(b"\\", b"\\\\")
+    for c in (b"\t", b"\n", b"\r"):
+        if c in b:
+            b = b.replace(c, _ESCAPES[c])
+    return b
+
+
+def _unescape(b):
+    if b"\\" not in b:
+        return b
+    out = []
+    parts = b.split(b"\\")
+    out.append(parts[0])
+    i = 1
+    while i < len(parts):
+        part = parts[i]
+        if not part:
+            # An escaped backslash splits into an empty part.
+            out.append(b"\\")
+            i += 1
+            if i < len(parts):
+                out.append(parts[i])
+        else:
+            out.append(_UNESCAPES.get(part[:1], b"\\" + part[:1]))
+            out.append(part[1:])
+        i += 1
+    return b"".join(out)
+
+
+def _text(b):
+    return b.decode("utf-8", "surrogateescape")
+
+
+def _bytes(s):
+    return s.encode("utf-8", "surrogateescape")
+
+
+def read_records(f, fmt):
+    """Yields (key, value) pairs from a binary file object.
+
+    value is None for deletes, which only the jsonl format can express.
+
+    """
+    if fmt == "tsv":
+        for line in f:
+            line = line.rstrip(b"\r\n")
+            if not line:
+                continue
+            key, sep, value = line.partition(b"\t")
+            if not sep:
+                raise sparkey.SparkeyException("Missing tab in %r" % line)
+            yield _unescape(key), _unescape(value)
+    elif fmt == "jsonl":
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line.decode("utf-8"))
+            value = record.get("value")
+            yield (_bytes(record["key"]),
+                   None if value is None else _bytes(value))
+    else:
+        while True:
+            header = f.read(_u32.size)
+            if not header:
+                return
+            header = _read_rest(f, header, _u32.size)
+            key = _read_rest(f, b"", _u32.unpack(header)[0])
+            header = _read_rest(f, b"", _u32.size)
+            value = _read_rest(f, b"", _u32.unpack(header)[0])
+            yield key, value
+
+
+def _read_rest(f, data, size):
+    """Reads from f until data is size bytes long."""
+    while len(data) < size:
+        chunk = f.read(size - len(data))
+        if not chunk:
+            raise sparkey.SparkeyException("Truncated record")
+        data += chunk
+    return data
+
+
+def write_record(f, fmt, key, value):
+    if fmt == "tsv":
+        f.write(_escape(key) + b"\t" + _escape(value) + b"\n")
+    elif fmt == "jsonl":
+        f.write(json.dumps({"key": _text(key), "value": _text(value)})
+                .encode("utf-8") + b"\n")
+    else:
+        f.write(_u32.pack(len(key)) + key + _u32.pack(len(value)) + value)
+
+
+def _open_input(path):
+    if path == "-":
+        return getattr(sys.stdin, "buffer", sys.stdin)
+    return open(path, "rb")
+
+
+def _stdout():
+    return getattr(sys.stdout, "buffer", sys.stdout)
+
+
+def build(args):
+    compression = {"none": sparkey.Compression.NONE,
+                   "snappy": sparkey.Compression.SNAPPY}[args.compression]
+    writer = sparkey.LogWriter(args.logfile,
+                               mode="APPEND" if args.append else "NEW",
+                               compression_type=compression,
+                               compression_block_size=args.block_size)
+    puts = deletes = 0
+    f = _open_input(args.input)
+    try:
+        put = writer.put
+        for key, value in read_records(f, args.format):
+            if value is None:
+                writer.delete(key)
+                deletes += 1
+            else:
+                put(key, value)
+                puts += 1
+    finally:
+        if args.input != "-":
+            f.close()
+        writer.close()
+    if not args.no_hash:
+        sparkey.writehash(args.hashfile, args.logfile, args.hash_size)
+    print("Wrote %d puts and %d deletes" % (puts, deletes), file=sys.stderr)
+
+
+def get(args):
+    reader = sparkey.HashReader(args.hashfile, args.logfile)
+    value = reader.get(_bytes(args.key))
+    reader.close()
+    if value is None:
+        return 1
+    out = _stdout()
+    out.write(value)
+    out.flush()
+    return 0
+
+
+def mget(args):
+    reader = sparkey.HashReader(args.hashfile, args.logfile)
+    out = _stdout()
+    missing = 0
+    if args.keys:
+        keys = (_bytes(k) for k in args.keys)
+    else:
+        keys = (_unescape(line.rstrip(b"\r\n"))
+                for line in _open_input("-"))
+    for key in keys:
+        value = reader.get(key)
+        if value is None:
+            missing += 1
+        else:
+            write_record(out, args.format, key, value)
+    out.flush()
+    reader.close()
+    return 1 if missing else 0
+
+
+def dump(args):
+    reader = sparkey.HashReader(args.hashfile, args.logfile)
+    out = _stdout()
+    fmt = args.format
+    for key, value in reader:
+        write_record(out, fmt, key, value)
+    out.flush()
+    reader.close()
+
+
+def stats(args):
+    reader = sparkey.HashReader(args.hashfile, args.logfile)
+    result = {
+        "entries": len(reader),
+        "hash_collisions": reader.num_collisions(),
+        "hash_bytes": os.path.getsize(args.hashfile),
+        "log_bytes": os.path.getsize(args.logfile),
+        "compression": {sparkey.Compression.NONE: "none",
+                        sparkey.Compression.SNAPPY: "snappy"}.get(
+                            reader.compression_type(), "unknown"),
+        "compression_block_size": reader.compression_block_size(),
+    }
+    reader.close()
+    if not args.quick:
+        puts = deletes = live_bytes = total_bytes = 0
+        log = sparkey.LogReader(args.logfile)
+        for key, value, type_ in log:
+            total_bytes += len(key) + len(value)
+            if type_ == sparkey.IterType.PUT:
+                puts += 1
+            else:
+                deletes += 1
+        log.close()
+        reader = sparkey.HashReader(args.hashfile, args.logfile)
+        for key, value in reader:
+            live_bytes += len(key) + len(value)
+        reader.close()
+        log_entries = puts + deletes
+        result.update({
+            "log_puts": puts,
+            "log_deletes": deletes,
+            "garbage_ratio": (1 - result["entries"] / log_entries
+                              if log_entries else 0.0),
+            "live_bytes": live_bytes,
+            "uncompressed_bytes": total_bytes,
+            "compression_ratio": (total_bytes / result["log_bytes"]
+                                  if result["log_bytes"] else None),
+        })
+    print(json.dumps(result, indent=2, sort_keys=True))
+
+
+def diff(args):
+    from sparkey.diff import diff as diff_stores, ADDED, REMOVED
+    old = sparkey.HashReader(args.hashfile, args.logfile)
+    new = sparkey.HashReader(args.new_hashfile, args.new_logfile)
+    out = _stdout()
+    changes = 0
+    marks = {ADDED: b"+\t", REMOVED: b"-\t"}
+    for change, key in diff_stores(old, new):
+        out.write(marks.get(change, b"~\t") + _escape(key) + b"\n")
+        changes += 1
+    out.flush()
+    new.close()
+    old.close()
+    return 1 if changes else 0
+
+
+def export(args):
+    from sparkey.export import export as export_store
+    result = export_store(args.hashfile, args.logfile, args.output,
+                          format=args.format, compression=args.compression)
+    print("Wrote %(rows)d rows in %(batches)d batches" % result,
+          file=sys.stderr)
+
+
+def _sample_keys(reader, size, rng):
+    # Reservoir sampling, to pick keys in a single pass and fixed memory.
+    sample = []
+    for i, (key, _) in enumerate(reader):
+        if i < size:
+            sample.append(key)
+        else:
+            j = rng.randint(0, i)
+            if j < size:
+                sample[j] = key
+    return sample
+
+
+def bench(args):
+    rng = random.Random(args.seed)
+    reader = sparkey.HashReader(args.hashfile, args.logfile,
+                                cache_size=args.cache_size)
+    keys = _sample_keys(reader, args.sample, rng)
+    if not keys:
+        raise sparkey.SparkeyException("Store is empty")
+    results = {}
+    for name, make_key in (("hit", lambda: rng.choice(keys)),
+                           ("miss", lambda: b"\0miss%d" % rng.getrandbits(63))):
+        lookups = [make_key() for _ in range(args.lookups)]
+        latency = Histogram()
+        get = reader.get
+        start = clock_ns()
+        for key in lookups:
+            t0 = clock_ns()
+            get(key)
+            latency.record(clock_ns() - t0)
+        elapsed = (clock_ns() - start) / 1e9
+        results[name] = {"lookups": len(lookups),
+                         "seconds": elapsed,
+                         "lookups_per_second": len(lookups) / elapsed,
+                         "latency_us": latency.snapshot()}
+    if args.cache_size:
+        results["cache"] = reader.cache_info()
+    reader.close()
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m sparkey",
+        description="Build, inspect and export sparkey stores.")
+    commands = parser.add_subparsers(dest="command")
+
+    def command(name, func, help):
+        p = commands.add_parser(name, help=help)
+        p.add_argument("hashfile")
+        p.add_argument("logfile")
+        p.set_defaults(func=func)
+        return p
+
+    p = command("build", build, "write a store from records")
+    p.add_argument("--input", default="-", help="input file, - for stdin")
+    p.add_argument("--format", choices=FORMATS, default="tsv")
+    p.add_argument("--compression", choices=("none", "snappy"),
+                   default="none")
+    p.add_argument("--block-size", type=int, default=0,
+                   help="compression block size, required for snappy")
+    p.add_argument("--hash-size", type=int, default=0, choices=(0, 4, 8))
+    p.add_argument("--append", action="store_true",
+                   help="append to an existing log")
+    p.add_argument("--no-hash", action="store_true",
+                   help="only write the log")
+
+    p = command("get", get, "print the value of a key")
+    p.add_argument("key")
+
+    p = command("mget", mget, "look up keys given as arguments, or on "
+                "stdin one per line with tsv escapes")
+    p.add_argument("keys", nargs="*")
+    p.add_argument("--format", choices=FORMATS, default="tsv")
+
+    p = command("dump", dump, "write all live entries to stdout")
+    p.add_argument("--format", choices=FORMATS, default="tsv")
+
+    p = command("stats", stats, "print information about a store")
+    p.add_argument("--quick", action="store_true",
+                   help="skip the statistics that need a full scan")
+
+    p = command("diff", diff, "list keys that were added (+), removed (-) "
+                "or changed (~) in a new store")
+    p.add_argument("new_hashfile")
+    p.add_argument("new_logfile")
+
+    p = command("export", export, "write all live entries to a Parquet or "
+                "Arrow IPC file (requires pyarrow)")
+    p.add_argument("output")
+    p.add_argument("--format", choices=("parquet", "arrow"),
+                   help="by default picked from the output file extension")
+    p.add_argument("--compression", help="codec, e.g. zstd")
+
+    p = command("bench", bench, "time random lookups")
+    p.add_argument("--lookups", type=int, default=100000)
+    p.add_argument("--sample", type=int, default=100000,
+                   help="number of keys to sample from the store")
+    p.add_argument("--cache-size", type=int, default=0)
+    p.add_argument("--seed", type=int, default=4711)
+    return parser
+
+
+def main(argv=None):
+    parser = _parser()
+    args = parser.parse_args(argv)
+    if not getattr(args, "func", None):
+        parser.error("expected a command")
+    try:
+        return args.func(args) or 0
+    except sparkey.SparkeyException as e:
+        print("error: %s" % e, file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
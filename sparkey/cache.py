@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A byte-bounded LRU cache for looked up values."""
+
+from builtins import object
+from collections import OrderedDict
+import sys
+import threading
+
+# Returned by LRUCache.get for keys that are not cached, since None is a
+# valid cached value (a lookup miss).
+MISSING = object()
+
+
+def _entry_size(key, value):
+    return sys.getsizeof(key) + sys.getsizeof(value)
+
+
+class LRUCache(object):
+    """Maps keys to values, evicting the least recently used entries once
+    the approximate memory used by keys and values exceeds max_bytes.
+
+    This is threadsafe.
+
+    """
+
+    def __init__(self, max_bytes):
+        """@param max_bytes: upper bound for the memory used by entries."""
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.clear()
+
+    def after_fork(self):
+        """Makes the cache usable in a forked child, keeping its entries."""
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def clear(self):
+        """Removes all entries and resets the counters."""
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def get(self, key):
+        """Returns the cached value for key, or L{MISSING}."""
+        with self._lock:
+            value = self._data.pop(key, MISSING)
+            if value is MISSING:
+                self.misses += 1
+            else:
+                self._data[key] = value
+                self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = _entry_size(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, MISSING)
+            if old is not MISSING:
+                self.bytes -= _entry_size(key, old)
+            self._data[key] = value
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                old_key, old = self._data.popitem(last=False)
+                self.bytes -= _entry_size(old_key, old)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._data)
+
+    def info(self):
+        """Returns the size and hit rate of the cache as a dict."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._data),
+                    "bytes": self.bytes,
+                    "max_bytes": self.max_bytes,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "hit_rate": float(self.hits) / lookups if lookups else 0.0}
@@ -0,0 +1,166 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Streaming comparison of two stores.
+
+    for change, key in diff(old_reader, new_reader):
+        if change == REMOVED:
+            ...
+
+L{diff} walks the native iterators directly: keys and values are read
+into buffers that are reused across entries, values are only read when
+their lengths match, and are then compared with memcmp. No Python
+objects are created for entries that did not change.
+
+"""
+
+import ctypes
+
+import sparkey
+from sparkey import (_ptr, _byref, _c_ulonglong, _create_string_buffer,
+                     IterState)
+
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+
+try:
+    _memcmp = ctypes.CDLL(None).memcmp
+    _memcmp.restype = ctypes.c_int
+    _memcmp.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t]
+except (OSError, AttributeError, TypeError):
+    # No libc symbols in the process, e.g. on Windows.
+    _memcmp = None
+
+
+class _Buffer(object):
+    """A growable native buffer."""
+
+    def __init__(self, size=256):
+        self.size = size
+        self.buf = _create_string_buffer(size)
+
+    def reserve(self, size):
+        if size > self.size:
+            self.size = max(size, self.size * 2)
+            self.buf = _create_string_buffer(self.size)
+        return self.buf
+
+
+def _equal(a, b, length):
+    if _memcmp is not None:
+        return _memcmp(a, b, length) == 0
+    return ctypes.string_at(a, length) == ctypes.string_at(b, length)
+
+
+class _Side(object):
+    """Native iterators over one store: one to scan, one to probe."""
+
+    def __init__(self, reader):
+        reader._assert_open()
+        self.reader = reader
+        self.log = sparkey._native("_hash_getreader")(reader._reader)
+        self.scan = _ptr()
+        self.probe = _ptr()
+        create = sparkey._native("_logiter_create")
+        create(_byref(self.scan), self.log)
+        create(_byref(self.probe), self.log)
+
+    def close(self):
+        close = sparkey._native("_logiter_close")
+        for it in (self.scan, self.probe):
+            if it:
+                close(_byref(it))
+
+
+def _read(iterator, log, fill, length, buf):
+    got = _c_ulonglong()
+    fill(iterator, log, length, buf.reserve(length), _byref(got))
+    if got.value != length:
+        raise sparkey.SparkeyException("Invalid length, expected %s but got %s"
+                                       % (length, got.value))
+    return buf.buf
+
+
+def _walk(scanned, probed, compare_values):
+    """Yields keys that are live in scanned, with a flag that is True if
+    the key is live in probed with a different value, and False if it is
+    not live in probed at all. Unchanged keys are skipped."""
+    scan, probe = scanned.scan, probed.probe
+    scan_log, probe_log = scanned.log, probed.log
+    scan_reader, probe_reader = scanned.reader._reader, probed.reader._reader
+    key_buf, value_buf, probe_buf = _Buffer(), _Buffer(), _Buffer()
+    hashnext = sparkey._native("_logiter_hashnext")
+    hash_get = sparkey._native("_hash_get")
+    state = sparkey._native("_logiter_state")
+    keylen_of = sparkey._native("_logiter_keylen")
+    valuelen_of = sparkey._native("_logiter_valuelen")
+    fill_key = sparkey._native("_logiter_fill_key")
+    fill_value = sparkey._native("_logiter_fill_value")
+    active = IterState.ACTIVE
+    while True:
+        hashnext(scan, scan_reader)
+        if state(scan) != active:
+            return
+        keylen = keylen_of(scan)
+        key = _read(scan, scan_log, fill_key, keylen, key_buf)
+        hash_get(probe_reader, key, keylen, probe)
+        if state(probe) != active:
+            yield ctypes.string_at(key, keylen), False
+            continue
+        if not compare_values:
+            continue
+        valuelen = valuelen_of(scan)
+        if valuelen_of(probe) != valuelen:
+            yield ctypes.string_at(key, keylen), True
+            continue
+        if not valuelen:
+            continue
+        a = _read(scan, scan_log, fill_value, valuelen, value_buf)
+        b = _read(probe, probe_log, fill_value, valuelen, probe_buf)
+        if not _equal(a, b, valuelen):
+            yield ctypes.string_at(key, keylen), True
+
+
+def diff(old, new):
+    """Yields the differences between two stores as (change, key) pairs.
+
+    change is L{ADDED} for keys only in new, L{CHANGED} for keys with
+    different values, and L{REMOVED} for keys only in old. Added and
+    changed keys come first, in the log order of new, followed by the
+    removed keys in the log order of old.
+
+    Memory use is constant. Both readers must stay open, and must not be
+    used by other threads, until the generator is exhausted or closed.
+
+    @param old: L{HashReader} of the old store.
+
+    @param new: L{HashReader} of the new store.
+
+    """
+    new_side = _Side(new)
+    try:
+        old_side = _Side(old)
+        try:
+            for key, changed in _walk(new_side, old_side, True):
+                yield (CHANGED if changed else ADDED), key
+            for key, _ in _walk(old_side, new_side, False):
+                yield REMOVED, key
+        finally:
+            old_side.close()
+    finally:
+        new_side.close()
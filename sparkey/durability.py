@@ -0,0 +1,270 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Group commit for log writers.
+
+Any number of threads can write through a L{GroupCommitWriter}. It
+hands their writes to a single thread that owns the underlying writer.
+That thread applies the writes in groups, and makes each group durable
+with one flush, and optionally one fsync. The cost of syncing is then
+shared by every write in the group:
+
+    committer = GroupCommitWriter(sparkey.LogWriter("data.spl"),
+                                  durability=FSYNC, max_delay=0.005)
+    committer.put(key, value).result()  # returns once it is on disk
+    ...
+    committer.close()
+
+Durability modes, from fastest to safest:
+    - L{NONE}: writes are applied, and only flushed every flush_interval
+      seconds, when buffers fill up, or on L{GroupCommitWriter.flush}.
+    - L{FLUSH}: each group is flushed to the file, so it survives a crash
+      of the process.
+    - L{FSYNC}: each group is also fsynced, so it survives a crash of the
+      machine.
+
+"""
+
+from concurrent.futures import Future
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import sparkey
+
+NONE = "none"
+FLUSH = "flush"
+FSYNC = "fsync"
+
+_PUT = 0
+_DELETE = 1
+_BARRIER = 2
+_STOP = object()
+
+_clock = getattr(time, "monotonic", time.time)
+
+
+class GroupCommitWriter(sparkey._Closeable):
+    """Serializes writes from many threads onto one writer, committing
+    them in groups.
+
+    Writes are applied in the order they were submitted. put, delete and
+    flush are threadsafe; the underlying writer must not be used by
+    anything else until L{close} has returned.
+
+    For a L{HashWriter}, groups are committed with
+    L{HashWriter.flush_log}, so the hash is only rebuilt when the writer
+    is closed.
+
+    """
+
+    def __init__(self, writer, durability=FLUSH, max_batch=1024,
+                 max_batch_bytes=1 << 20, max_delay=0.002,
+                 flush_interval=None, max_pending=65536):
+        """@param writer: a L{LogWriter} or L{HashWriter}.
+
+        @param durability: L{NONE}, L{FLUSH} or L{FSYNC}.
+
+        @param max_batch: maximum number of writes in a group.
+
+        @param max_batch_bytes: a group is committed once its keys and
+                                values add up to this many bytes.
+
+        @param max_delay: seconds to wait for more writes before a group
+                          is committed. Higher values give larger groups,
+                          and fewer flushes, at the cost of latency.
+
+        @param flush_interval: with durability L{NONE}, flush writes
+                               that have been idle for this many seconds.
+
+        @param max_pending: maximum number of queued writes, after which
+                            writers block.
+
+        """
+        if durability not in (NONE, FLUSH, FSYNC):
+            raise sparkey.SparkeyException(
+                "durability must be one of %r, %r and %r"
+                % (NONE, FLUSH, FSYNC))
+        self._writer = writer
+        # Flushing a HashWriter also rebuilds its hash, so flush its log.
+        self._flush = getattr(writer, "flush_log", writer.flush)
+        self._durability = durability
+        self._max_batch = max_batch
+        self._max_batch_bytes = max_batch_bytes
+        self._max_delay = max_delay
+        self._flush_interval = flush_interval
+        self._queue = queue.Queue(max_pending)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._dirty = False
+        self._error = None
+        self.groups = 0
+        self.writes = 0
+        self._thread = threading.Thread(target=self._run,
+                                        name="sparkey-group-commit")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, key, value):
+        """Queues a put.
+
+        @returns: a C{concurrent.futures.Future} that completes once the
+                  put is as durable as the durability mode promises.
+                  Cancelling it before it is written drops the put.
+
+        """
+        return self._submit(_PUT, sparkey._to_bytes(key, "key"),
+                            sparkey._to_bytes(value, "value"))
+
+    def delete(self, key):
+        """Queues a delete. Returns a future, see L{put}."""
+        return self._submit(_DELETE, sparkey._to_bytes(key, "key"), None)
+
+    def flush(self):
+        """Flushes all writes submitted so far, and fsyncs them if the
+        durability mode is L{FSYNC}.
+
+        @returns: a C{concurrent.futures.Future} that completes once
+                  done.
+
+        """
+        return self._submit(_BARRIER, None, None)
+
+    def _submit(self, op, key, value):
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise sparkey.SparkeyException("Writer is closed")
+            self._queue.put((op, key, value, future))
+        return future
+
+    def close(self):
+        """Commits all queued writes and stops the writer thread.
+
+        The underlying writer is left open. Close it afterwards; for a
+        L{HashWriter} that also rebuilds the hash.
+
+        @raise Exception: the error of a failed background flush, if
+                          any.
+
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def info(self):
+        """Returns the number of groups and writes committed so far, and
+        the number of queued writes, as a dict."""
+        groups = self.groups
+        return {"groups": groups,
+                "writes": self.writes,
+                "mean_group_size": float(self.writes) / groups
+                                   if groups else 0.0,
+                "pending": self._queue.qsize()}
+
+    def _run(self):
+        get = self._queue.get
+        stop = False
+        while not stop:
+            timeout = None
+            if self._dirty and self._flush_interval:
+                timeout = self._flush_interval
+            try:
+                item = get(timeout=timeout)
+            except queue.Empty:
+                self._idle_flush()
+                continue
+            if item is _STOP:
+                break
+            group = [item]
+            size = _size(item)
+            deadline = _clock() + self._max_delay
+            while (len(group) < self._max_batch
+                   and size < self._max_batch_bytes):
+                remaining = deadline - _clock()
+                try:
+                    if remaining > 0:
+                        item = get(timeout=remaining)
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                group.append(item)
+                size += _size(item)
+            self._commit(group)
+        if self._dirty:
+            try:
+                self._flush(fsync=self._durability == FSYNC)
+                self._dirty = False
+            except Exception as e:
+                self._error = e
+
+    def _idle_flush(self):
+        try:
+            self._flush()
+            self._dirty = False
+        except Exception as e:
+            self._error = e
+
+    def _commit(self, group):
+        # Cancelled writes are dropped, the rest can not be cancelled now.
+        group = [item for item in group
+                 if item[3].set_running_or_notify_cancel()]
+        if not group:
+            return
+        writer = self._writer
+        barrier = False
+        try:
+            for op, key, value, _ in group:
+                if op == _PUT:
+                    writer.put(key, value)
+                elif op == _DELETE:
+                    writer.delete(key)
+                else:
+                    barrier = True
+            self._dirty = True
+            if barrier or self._durability != NONE:
+                self._flush(fsync=self._durability == FSYNC)
+                self._dirty = False
+        except Exception as e:
+            for item in group:
+                item[3].set_exception(e)
+            return
+        self.groups += 1
+        for op, _, _, future in group:
+            if op != _BARRIER:
+                self.writes += 1
+            future.set_result(None)
+
+
+def _size(item):
+    op, key, value, _ = item
+    if op == _PUT:
+        return len(key) + len(value)
+    return len(key or b"")
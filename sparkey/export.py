@@ -0,0 +1,290 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Export of live entries to Parquet or Arrow IPC files.
+
+    export("store.spi", "store.spl", "snapshot.parquet")
+
+The result has two binary columns, key and value. Entries are read by
+the native iterator straight into the buffers of Arrow record batches,
+without creating Python objects per entry. One thread scans the store
+while another encodes and writes the previous batches, and hands their
+buffers back to be filled again. Memory use is bounded by the batch size
+times the number of batches in flight.
+
+Requires pyarrow.
+
+"""
+
+from builtins import object
+import ctypes
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import pyarrow
+
+import sparkey
+from sparkey import _ptr, _byref, _c_ulonglong, IterState
+
+SCHEMA = pyarrow.schema([("key", pyarrow.binary()),
+                         ("value", pyarrow.binary())])
+
+# Arrow binary columns use 32 bit offsets.
+_MAX_COLUMN_BYTES = (1 << 31) - 1
+
+# Column buffers start this small and grow up to the batch size, so
+# small stores do not pay for full size batches.
+_INITIAL_COLUMN_BYTES = 64 << 10
+
+_DONE = object()
+
+
+class _Column(object):
+    """The offsets and data buffers of one binary column of a batch."""
+
+    def __init__(self, max_rows, max_bytes):
+        self.offsets = (ctypes.c_int32 * (max_rows + 1))()
+        self.data = ctypes.create_string_buffer(
+            min(max_bytes, _INITIAL_COLUMN_BYTES))
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._addr = ctypes.addressof(self.data)
+
+    def fill(self, fill, iterator, log, length, row):
+        end = self.used + length
+        size = ctypes.sizeof(self.data)
+        if end > size:
+            ctypes.resize(self.data, min(self.max_bytes, max(end, size * 2)))
+            self._addr = ctypes.addressof(self.data)
+        got = _c_ulonglong()
+        fill(iterator, log, length, self._addr + self.used, _byref(got))
+        if got.value != length:
+            raise sparkey.SparkeyException(
+                "Invalid length, expected %s but got %s" % (length, got.value))
+        self.used += length
+        self.offsets[row + 1] = self.used
+
+    def to_arrow(self, rows):
+        offsets = pyarrow.py_buffer(self.offsets)
+        data = pyarrow.py_buffer(self.data)
+        return pyarrow.Array.from_buffers(
+            pyarrow.binary(), rows,
+            [None, offsets.slice(0, (rows + 1) * 4),
+             data.slice(0, self.used)])
+
+
+class _Batch(object):
+    def __init__(self, max_rows, max_bytes):
+        self.max_rows = max_rows
+        self.rows = 0
+        self.keys = _Column(max_rows, max_bytes)
+        self.values = _Column(max_rows, max_bytes)
+
+    def fits(self, keylen, valuelen):
+        return (self.rows < self.max_rows
+                and self.keys.used + keylen <= self.keys.max_bytes
+                and self.values.used + valuelen <= self.values.max_bytes)
+
+    def reset(self):
+        self.rows = self.keys.used = self.values.used = 0
+
+    def add(self, fill_key, fill_value, iterator, log, keylen, valuelen):
+        self.keys.fill(fill_key, iterator, log, keylen, self.rows)
+        self.values.fill(fill_value, iterator, log, valuelen, self.rows)
+        self.rows += 1
+
+    def to_arrow(self):
+        """Returns a record batch that shares the buffers of this batch,
+        so it must not be used once the batch is refilled."""
+        return pyarrow.RecordBatch.from_arrays(
+            [self.keys.to_arrow(self.rows), self.values.to_arrow(self.rows)],
+            schema=SCHEMA)
+
+
+def _scan(hashfile, logfile, batch_rows, batch_bytes, free):
+    """Yields the live entries of a store as L{_Batch}es.
+
+    Batches of batch_bytes put on the free queue once written are filled
+    again, instead of allocating new ones.
+
+    """
+    def new_batch(size):
+        if size == batch_bytes:
+            try:
+                return free.get_nowait()
+            except queue.Empty:
+                pass
+        return _Batch(batch_rows, size)
+
+    reader = sparkey.HashReader(hashfile, logfile)
+    iterator = _ptr()
+    try:
+        log = sparkey._native("_hash_getreader")(reader._reader)
+        sparkey._native("_logiter_create")(_byref(iterator), log)
+        hashnext = sparkey._native("_logiter_hashnext")
+        state = sparkey._native("_logiter_state")
+        keylen_of = sparkey._native("_logiter_keylen")
+        valuelen_of = sparkey._native("_logiter_valuelen")
+        fill_key = sparkey._native("_logiter_fill_key")
+        fill_value = sparkey._native("_logiter_fill_value")
+        native_reader = reader._reader
+        active = IterState.ACTIVE
+        batch = new_batch(batch_bytes)
+        while True:
+            hashnext(iterator, native_reader)
+            if state(iterator) != active:
+                break
+            keylen = keylen_of(iterator)
+            valuelen = valuelen_of(iterator)
+            if not batch.fits(keylen, valuelen):
+                if batch.rows:
+                    yield batch
+                size = max(batch_bytes, keylen, valuelen)
+                if size > _MAX_COLUMN_BYTES:
+                    raise sparkey.SparkeyException(
+                        "Entry too large for an Arrow binary column")
+                batch = new_batch(size)
+            batch.add(fill_key, fill_value, iterator, log, keylen,
+                      valuelen)
+        if batch.rows:
+            yield batch
+    finally:
+        if iterator:
+            sparkey._native("_logiter_close")(_byref(iterator))
+        reader.close()
+
+
+class _Failure(object):
+    def __init__(self, error):
+        self.error = error
+
+
+def _produce(batches, pending, stop):
+    def put(item):
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    try:
+        for batch in batches:
+            if stop.is_set():
+                return
+            put(batch)
+        put(_DONE)
+    except Exception as e:
+        put(_Failure(e))
+    finally:
+        # Releases the reader right away if the writer gave up.
+        batches.close()
+
+
+def _open_writer(path, format, compression):
+    if format == "parquet":
+        import pyarrow.parquet
+        return pyarrow.parquet.ParquetWriter(
+            path, SCHEMA, compression=compression or "snappy")
+    if format == "arrow":
+        import pyarrow.ipc
+        options = pyarrow.ipc.IpcWriteOptions(compression=compression)
+        return pyarrow.ipc.new_file(path, SCHEMA, options=options)
+    raise sparkey.SparkeyException("format must be 'parquet' or 'arrow'")
+
+
+def _write(writer, format, batch):
+    # The Arrow objects share the batch's buffers, and are dropped before
+    # it is refilled.
+    record_batch = batch.to_arrow()
+    if format == "parquet":
+        writer.write_table(pyarrow.Table.from_batches([record_batch]))
+    else:
+        writer.write_batch(record_batch)
+
+
+def export(hashfile, logfile, path, format=None, compression=None,
+           batch_rows=65536, batch_bytes=16 << 20, max_pending=2):
+    """Writes the live entries of a store to a Parquet or Arrow IPC file.
+
+    Memory use is bounded by about 2 * batch_bytes * (max_pending + 2).
+
+    @param hashfile: hash file of the store.
+
+    @param logfile: log file of the store.
+
+    @param path: file to create.
+
+    @param format: 'parquet' or 'arrow'. By default 'arrow' for paths
+                   ending in .arrow, .feather or .ipc, else 'parquet'.
+
+    @param compression: codec name passed to pyarrow, e.g. 'zstd'. By
+                        default snappy for Parquet and none for Arrow.
+
+    @param batch_rows: maximum number of entries in a record batch (and
+                       Parquet row group).
+
+    @param batch_bytes: maximum size of the keys, and of the values, of
+                        a record batch. Larger entries get a batch of
+                        their own.
+
+    @param max_pending: number of scanned batches that may wait for the
+                        writer.
+
+    @returns: a dict with the number of rows and batches written.
+
+    """
+    if format is None:
+        format = "arrow" if str(path).endswith(
+            (".arrow", ".feather", ".ipc")) else "parquet"
+    if not 0 < batch_bytes <= _MAX_COLUMN_BYTES:
+        raise sparkey.SparkeyException("batch_bytes must be positive and "
+                                       "less than 2 GiB")
+    writer = _open_writer(path, format, compression)
+    pending = queue.Queue(max_pending)
+    free = queue.Queue()
+    stop = threading.Event()
+    producer = threading.Thread(
+        target=_produce,
+        args=(_scan(hashfile, logfile, batch_rows, batch_bytes, free),
+              pending, stop),
+        name="sparkey-export")
+    producer.daemon = True
+    producer.start()
+    rows = batches = 0
+    try:
+        while True:
+            item = pending.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.error
+            _write(writer, format, item)
+            rows += item.rows
+            batches += 1
+            if item.keys.max_bytes == batch_bytes:
+                item.reset()
+                free.put(item)
+    finally:
+        stop.set()
+        producer.join()
+        writer.close()
+    return {"rows": rows, "batches": batches}
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rewrites a store so that frequently accessed entries are stored together.
+
+Entries are laid out in the log in the order they were written, so a hot
+working set is usually spread over the whole file. L{optimize_layout}
+writes the live entries to a new log, hottest first, and hashes it.
+The hot entries then share pages (and Snappy blocks), so fewer pages
+need to stay in memory to serve them.
+
+    python -m sparkey.layout store.spi store.spl out.spi out.spl \\
+        --frequencies counts.tsv
+
+Access counts can also be taken from a trace captured with
+L{sparkey.trace.Tracer}, using --trace.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import os
+
+import sparkey
+
+
+def _normalize(frequencies, key):
+    if not hasattr(frequencies, "items"):
+        # An access trace: one key per access.
+        frequencies = collections.Counter(
+            k if key is not None else sparkey._to_bytes(k, "key")
+            for k in frequencies)
+    elif key is None:
+        frequencies = dict((sparkey._to_bytes(k, "key"), v)
+                           for k, v in frequencies.items())
+    return frequencies
+
+
+def optimize_layout(hashfile, logfile, out_hashfile, out_logfile,
+                    frequencies, key=None, compression_type=None,
+                    compression_block_size=None, hash_size=0):
+    """Writes the live entries of a store to a new store, hottest first.
+
+    Memory use is proportional to the number of keys with a non-zero
+    frequency; the rest of the store is streamed.
+
+    @param hashfile: hash file of the store to rewrite.
+
+    @param logfile: log file of the store to rewrite.
+
+    @param out_hashfile: hash file to create, must differ from
+                         hashfile.
+
+    @param out_logfile: log file to create, must differ from logfile.
+
+    @param frequencies: a mapping of key to access count, or an iterable
+                        of keys with one element per access.
+
+    @param key: optional function mapping a key (bytes) in the store to
+                the key used in frequencies, e.g. a digest.
+
+    @param compression_type: compression of the new log, by default the
+                             same as the old one.
+
+    @param compression_block_size: block size of the new log, by default
+                                   the same as the old one.
+
+    @param hash_size: passed on to L{sparkey.writehash}.
+
+    @returns: a dict with the number of entries and hot entries written.
+
+    """
+    if os.path.realpath(logfile) == os.path.realpath(out_logfile):
+        raise sparkey.SparkeyException("Can not rewrite a log in place")
+    if os.path.realpath(hashfile) == os.path.realpath(out_hashfile):
+        raise sparkey.SparkeyException("Can not rewrite a hash in place")
+    frequencies = _normalize(frequencies, key)
+    reader = sparkey.HashReader(hashfile, logfile)
+    try:
+        if compression_type is None:
+            compression_type = reader.compression_type()
+        if compression_block_size is None:
+            compression_block_size = reader.compression_block_size()
+
+        hot = []
+        for k, _ in reader:
+            score = frequencies.get(k if key is None else key(k), 0)
+            if score > 0:
+                hot.append((-score, len(hot), k))
+        hot.sort()
+        hot_keys = set(k for _, _, k in hot)
+
+        writer = sparkey.LogWriter(out_logfile,
+                                   compression_type=compression_type,
+                                   compression_block_size=compression_block_size)
+        try:
+            for _, _, k in hot:
+                writer.put(k, reader.get(k))
+            # Start the cold entries on a fresh block.
+            writer.flush()
+            entries = len(hot)
+            for k, v in reader:
+                if k not in hot_keys:
+                    writer.put(k, v)
+                    entries += 1
+        finally:
+            writer.close()
+    finally:
+        reader.close()
+    sparkey.writehash(out_hashfile, out_logfile, hash_size)
+    return {"entries": entries, "hot_entries": len(hot)}
+
+
+def read_frequencies(path):
+    """Reads access counts from a file.
+
+    Each line is either a key, counting as one access, or a key and a
+    count separated by a tab.
+
+    """
+    counts = collections.Counter()
+    with open(path, "rb") as f:
+        for line in f:
+            line = line.rstrip(b"\r\n")
+            if not line:
+                continue
+            k, sep, count = line.rpartition(b"\t")
+            if sep:
+                counts[k] += int(count)
+            else:
+                counts[line] += 1
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m sparkey.layout",
+        description="Rewrite a store with its hottest entries first.")
+    parser.add_argument("hashfile")
+    parser.add_argument("logfile")
+    parser.add_argument("out_hashfile")
+    parser.add_argument("out_logfile")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--frequencies",
+                        help="file with one key per access, or "
+                             "key<TAB>count per line")
+    source.add_argument("--trace",
+                        help="trace file written by sparkey.trace.Tracer")
+    args = parser.parse_args(argv)
+    if args.trace:
+        from sparkey import trace
+        frequencies = trace.frequencies(args.trace)
+        key = trace.key_digest
+    else:
+        frequencies = read_frequencies(args.frequencies)
+        key = None
+    result = optimize_layout(args.hashfile, args.logfile, args.out_hashfile,
+                             args.out_logfile, frequencies, key=key)
+    print("Wrote %(entries)d entries, %(hot_entries)d hot" % result)
+
+
+if __name__ == "__main__":
+    main()
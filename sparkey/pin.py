@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Keeps files resident in memory.
+
+libsparkey reads hash and log files through its own shared memory maps,
+so their pages live in the page cache and can be evicted under memory
+pressure. A L{PinnedFile} maps the same file shared and locks the
+mapping with mlock. Since shared mappings of a file use the same page
+cache pages, this keeps the pages libsparkey reads from resident too.
+
+If the file can not be locked, typically because RLIMIT_MEMLOCK is too
+low, it falls back to madvise(MADV_WILLNEED), which reads the file into
+the page cache but does not keep it there.
+
+"""
+
+from builtins import object
+import ctypes
+import errno
+import mmap
+import os
+import threading
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_PROT_READ = getattr(mmap, "PROT_READ", 1)
+_MAP_SHARED = getattr(mmap, "MAP_SHARED", 1)
+_MADV_WILLNEED = getattr(mmap, "MADV_WILLNEED", 3)
+_MAP_FAILED = ctypes.c_void_p(-1).value
+
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _mmap = _libc.mmap
+    _mmap.restype = ctypes.c_void_p
+    _mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int,
+                      ctypes.c_int, ctypes.c_int, ctypes.c_long]
+    _munmap = _libc.munmap
+    _mlock = _libc.mlock
+    _munlock = _libc.munlock
+    _madvise = _libc.madvise
+    for _fn in (_munmap, _mlock, _munlock, _madvise):
+        _fn.restype = ctypes.c_int
+        _fn.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    _madvise.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int]
+except (OSError, AttributeError, TypeError):
+    _libc = None
+
+_lock = threading.Lock()
+_locked_bytes = 0
+
+
+def _error(name):
+    e = ctypes.get_errno()
+    return OSError(e, "%s: %s" % (name, os.strerror(e)))
+
+
+class PinnedFile(object):
+    """A file kept in memory for as long as this object is open."""
+
+    def __init__(self, path, lock=True):
+        """Maps a file and locks it in memory.
+
+        @param path: file to pin.
+
+        @param lock: if False, only ask the kernel to read the file in.
+
+        @raise OSError: if the file can not be opened or mapped. Failing
+                        to lock the file is not an error, see L{locked}.
+
+        """
+        if _libc is None:
+            raise OSError(errno.ENOSYS, "Pinning is not supported here")
+        self.path = path
+        self.locked = False
+        # The reason locking failed, if it did.
+        self.error = None
+        self._addr = None
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            self.size = os.fstat(fd).st_size
+            if not self.size:
+                return
+            addr = _mmap(None, self.size, _PROT_READ, _MAP_SHARED, fd, 0)
+            if addr is None or addr == _MAP_FAILED:
+                raise _error("mmap")
+        finally:
+            os.close(fd)
+        self._addr = addr
+        if lock:
+            self._lock()
+        if not self.locked:
+            _madvise(addr, self.size, _MADV_WILLNEED)
+
+    def _lock(self):
+        global _locked_bytes
+        if _mlock(self._addr, self.size) != 0:
+            self.error = str(_error("mlock"))
+            return
+        self.locked = True
+        with _lock:
+            _locked_bytes += self.size
+
+    def after_fork(self):
+        """Updates the lock state in a forked child.
+
+        Memory locks are not inherited, so the file is only locked in the
+        child for as long as the parent keeps it locked.
+
+        """
+        if self.locked:
+            self.locked = False
+            self.error = "mlock: not inherited across fork"
+
+    def close(self):
+        """Unlocks and unmaps the file."""
+        global _locked_bytes
+        addr, self._addr = self._addr, None
+        if addr is None:
+            return
+        if self.locked:
+            _munlock(addr, self.size)
+            self.locked = False
+            with _lock:
+                _locked_bytes -= self.size
+        _munmap(addr, self.size)
+
+    def __del__(self):
+        if _libc is not None:
+            self.close()
+
+    def info(self):
+        """Returns the path, size and lock state of the file as a dict."""
+        return {"path": self.path,
+                "bytes": self.size,
+                "locked": self.locked,
+                "error": self.error}
+
+
+def _after_fork():
+    global _lock, _locked_bytes
+    _lock = threading.Lock()
+    _locked_bytes = 0
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def locked_bytes():
+    """Returns the number of bytes locked by open L{PinnedFile}s."""
+    return _locked_bytes
+
+
+def memlock_limit():
+    """Returns the soft RLIMIT_MEMLOCK in bytes, or None if unlimited or
+    unknown."""
+    if resource is None or not hasattr(resource, "RLIMIT_MEMLOCK"):
+        return None
+    soft, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+    return None if soft == resource.RLIM_INFINITY else soft
@@ -0,0 +1,560 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Serves HashReader lookups to local processes over a Unix socket.
+
+Start a server with:
+
+    python -m sparkey.server --socket /run/sparkey.sock \\
+        --table users=users.spi:users.spl
+
+and look things up with a L{Client}:
+
+    client = Client("/run/sparkey.sock")
+    client.get_many("users", [b"alice", b"bob"])
+
+Protocol
+========
+All integers are big-endian. Each message is a frame of a u32 payload
+length followed by the payload. A request payload starts with a u8 op
+and a u32 request id, which is echoed in the response. Clients may send
+several requests before reading responses; they are answered in order.
+
+    GET:   u16 table length, table, u32 count,
+           count * (u32 key length, key)
+    LOAD:  table, hashfile, logfile, each as u16 length and bytes
+    PING:  no body
+
+A response payload is the u32 request id and a u8 status. For status OK
+the body of a GET response is u32 count, count * (i32 value length,
+value), where a length of -1 means the key was not found. For status
+ERROR the body is a u16 length and an UTF-8 message.
+
+"""
+
+from __future__ import print_function
+
+from builtins import object
+import argparse
+import os
+import socket
+import stat
+import struct
+import sys
+import threading
+
+try:
+    import queue
+    import socketserver
+except ImportError:
+    import Queue as queue
+    import SocketServer as socketserver
+
+import sparkey
+
+OP_GET = 1
+OP_LOAD = 2
+OP_PING = 3
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+MAX_FRAME = 1 << 30
+
+_u16 = struct.Struct(">H")
+_u32 = struct.Struct(">I")
+_i32 = struct.Struct(">i")
+_header = struct.Struct(">BI")
+_response_header = struct.Struct(">IB")
+
+
+def _frame(parts):
+    payload = b"".join(parts)
+    return _u32.pack(len(payload)) + payload
+
+
+def _short_bytes(s):
+    s = sparkey._to_bytes(s, "name")
+    return _u16.pack(len(s)) + s
+
+
+def encode_get(request_id, table, keys):
+    parts = [_header.pack(OP_GET, request_id), _short_bytes(table),
+             _u32.pack(len(keys))]
+    for key in keys:
+        key = sparkey._to_bytes(key, "key")
+        parts.append(_u32.pack(len(key)))
+        parts.append(key)
+    return _frame(parts)
+
+
+def encode_load(request_id, table, hashfile, logfile):
+    return _frame([_header.pack(OP_LOAD, request_id), _short_bytes(table),
+                   _short_bytes(hashfile), _short_bytes(logfile)])
+
+
+def encode_ping(request_id):
+    return _frame([_header.pack(OP_PING, request_id)])
+
+
+def encode_values(request_id, values):
+    parts = [_response_header.pack(request_id, STATUS_OK),
+             _u32.pack(len(values))]
+    for value in values:
+        if value is None:
+            parts.append(_i32.pack(-1))
+        else:
+            parts.append(_i32.pack(len(value)))
+            parts.append(value)
+    return _frame(parts)
+
+
+def encode_error(request_id, message):
+    message = message.encode("utf-8")[:0xffff]
+    return _frame([_response_header.pack(request_id, STATUS_ERROR),
+                   _u16.pack(len(message)), message])
+
+
+class _Decoder(object):
+    def __init__(self, payload):
+        self._view = memoryview(payload)
+        self._pos = 0
+
+    def _unpack(self, fmt):
+        value = fmt.unpack_from(self._view, self._pos)
+        self._pos += fmt.size
+        return value
+
+    def u16(self):
+        return self._unpack(_u16)[0]
+
+    def u32(self):
+        return self._unpack(_u32)[0]
+
+    def i32(self):
+        return self._unpack(_i32)[0]
+
+    def header(self, fmt):
+        return self._unpack(fmt)
+
+    def bytes(self, length):
+        if self._pos + length > len(self._view):
+            raise sparkey.SparkeyException("Truncated message")
+        view = self._view[self._pos:self._pos + length]
+        self._pos += length
+        return view
+
+    def short_bytes(self):
+        return self.bytes(self.u16()).tobytes()
+
+
+class _ServerError(sparkey.SparkeyException):
+    """An error response, which leaves the connection usable."""
+
+    def __init__(self, message, request_id):
+        sparkey.SparkeyException.__init__(self, message)
+        self.request_id = request_id
+
+
+def decode_response(payload):
+    """Decodes a response payload.
+
+    @returns: (request id, list of values) for GET responses, or
+              (request id, None) for other successful requests.
+
+    @raise SparkeyException: if the server returned an error.
+
+    """
+    decoder = _Decoder(payload)
+    request_id, status = decoder.header(_response_header)
+    if status == STATUS_ERROR:
+        raise _ServerError(decoder.short_bytes().decode("utf-8", "replace"),
+                           request_id)
+    if len(payload) == _response_header.size:
+        return request_id, None
+    values = []
+    for _ in range(decoder.u32()):
+        length = decoder.i32()
+        values.append(None if length < 0 else decoder.bytes(length).tobytes())
+    return request_id, values
+
+
+def _recv_frame(read):
+    header = read(_u32.size)
+    if not header:
+        return None
+    if len(header) < _u32.size:
+        raise sparkey.SparkeyException("Connection closed mid message")
+    length = _u32.unpack(header)[0]
+    if length > MAX_FRAME:
+        raise sparkey.SparkeyException("Message too large: %d" % length)
+    payload = read(length)
+    if len(payload) < length:
+        raise sparkey.SparkeyException("Connection closed mid message")
+    return payload
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        socketserver.StreamRequestHandler.setup(self)
+        # HashReader lookups are not threadsafe, so each connection does
+        # its lookups through its own iterators.
+        self._iterators = {}
+
+    def finish(self):
+        server = self.server.sparkey_server
+        for _, iterator in self._iterators.values():
+            server._close_iterator(iterator)
+        self._iterators = {}
+        socketserver.StreamRequestHandler.finish(self)
+
+    def handle(self):
+        while True:
+            try:
+                payload = _recv_frame(self.rfile.read)
+            except sparkey.SparkeyException:
+                return
+            if payload is None:
+                return
+            self.wfile.write(self._dispatch(payload))
+
+    def _dispatch(self, payload):
+        request_id = 0
+        try:
+            decoder = _Decoder(payload)
+            op, request_id = decoder.header(_header)
+            if op == OP_GET:
+                return encode_values(request_id, self._get(decoder))
+            if op == OP_LOAD:
+                table = decoder.short_bytes().decode("utf-8")
+                hashfile = decoder.short_bytes()
+                logfile = decoder.short_bytes()
+                self.server.sparkey_server.load(table, hashfile, logfile)
+                return _frame([_response_header.pack(request_id, STATUS_OK)])
+            if op == OP_PING:
+                return _frame([_response_header.pack(request_id, STATUS_OK)])
+            return encode_error(request_id, "Unknown op %d" % op)
+        except (sparkey.SparkeyException, struct.error, ValueError) as e:
+            return encode_error(request_id, str(e))
+
+    def _get(self, decoder):
+        table = decoder.short_bytes().decode("utf-8")
+        server = self.server.sparkey_server
+        reader = server._acquire(table)
+        try:
+            cached = self._iterators.get(table)
+            if cached is None or cached[0] is not reader:
+                # The table was (re)loaded since this connection last used
+                # it.
+                if cached is not None:
+                    server._close_iterator(cached[1])
+                cached = self._iterators[table] = (reader,
+                                                   reader.iteritems())
+            get = cached[1].get
+            values = []
+            for _ in range(decoder.u32()):
+                values.append(get(decoder.bytes(decoder.u32())))
+            return values
+        finally:
+            server._release(reader)
+
+
+class _SocketServer(socketserver.ThreadingMixIn,
+                    socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Server(object):
+    """Serves lookups in a set of named tables over a Unix socket."""
+
+    def __init__(self, path, tables=None, cache_size=0):
+        """Binds the socket, replacing any stale socket file, then opens
+        the tables.
+
+        @param path: path of the Unix socket.
+
+        @param tables: dict of table name to (hashfile, logfile).
+
+        @param cache_size: passed on to each L{sparkey.HashReader}.
+
+        """
+        self._cache_size = cache_size
+        self._tables = {}
+        # Number of requests using each reader, and the readers that have
+        # been replaced or unloaded, but are still in use.
+        self._users = {}
+        self._retired = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise sparkey.SparkeyException(
+                    "%s exists and is not a socket" % path)
+            os.remove(path)
+        self.path = path
+        self._serving = False
+        self._server = _SocketServer(path, _Handler)
+        self._server.sparkey_server = self
+        try:
+            for name, (hashfile, logfile) in (tables or {}).items():
+                self.load(name, hashfile, logfile)
+        except Exception:
+            self.close()
+            raise
+
+    def load(self, name, hashfile, logfile):
+        """Opens a table, atomically replacing any table with that name.
+
+        Lookups already in progress finish against the old generation,
+        which is closed once they are done.
+
+        """
+        reader = sparkey.HashReader(hashfile, logfile,
+                                    cache_size=self._cache_size)
+        with self._lock:
+            old = self._tables.get(name)
+            self._tables[name] = reader
+        self._retire(old)
+
+    def unload(self, name):
+        """Removes a table, closing it once lookups in progress are done."""
+        with self._lock:
+            old = self._tables.pop(name, None)
+        self._retire(old)
+
+    def _retire(self, reader):
+        if reader is None:
+            return
+        with self._lock:
+            if self._users.get(reader):
+                self._retired.add(reader)
+                return
+            reader.close()
+
+    def _acquire(self, name):
+        """Returns the current reader of a table, which is not closed
+        until L{_release} is called."""
+        with self._lock:
+            reader = self._tables.get(name)
+            if reader is None:
+                raise sparkey.SparkeyException("Unknown table %s" % name)
+            self._users[reader] = self._users.get(reader, 0) + 1
+            return reader
+
+    def _release(self, reader):
+        with self._lock:
+            users = self._users[reader] - 1
+            if users:
+                self._users[reader] = users
+                return
+            del self._users[reader]
+            if reader not in self._retired:
+                return
+            self._retired.discard(reader)
+            reader.close()
+
+    def _close_iterator(self, iterator):
+        # Returning an iterator to its reader's pool must not race with a
+        # retired reader being closed by another connection.
+        with self._lock:
+            iterator.close()
+
+    def reader(self, name):
+        """Returns the current L{sparkey.HashReader} of a table."""
+        reader = self._tables.get(name)
+        if reader is None:
+            raise sparkey.SparkeyException("Unknown table %s" % name)
+        return reader
+
+    def serve_forever(self):
+        self._serving = True
+        self._server.serve_forever()
+
+    def start(self):
+        """Serves requests on a background thread."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def close(self):
+        """Stops serving and removes the socket file."""
+        if self._serving:
+            self._server.shutdown()
+        self._server.server_close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        with self._lock:
+            tables, self._tables = self._tables, {}
+        for reader in tables.values():
+            self._retire(reader)
+
+
+class _Connection(object):
+    def __init__(self, path, timeout):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(path)
+        self._rfile = self._sock.makefile("rb")
+        self._next_id = 0
+
+    def send(self, encode, *args):
+        self._next_id = (self._next_id + 1) & 0xffffffff
+        self._sock.sendall(encode(self._next_id, *args))
+        return self._next_id
+
+    def receive(self, request_id):
+        payload = _recv_frame(self._rfile.read)
+        if payload is None:
+            raise sparkey.SparkeyException("Connection closed by server")
+        try:
+            response_id, values = decode_response(payload)
+        except _ServerError as e:
+            response_id = e.request_id
+            if response_id == request_id:
+                raise
+        if response_id != request_id:
+            raise sparkey.SparkeyException("Out of order response")
+        return values
+
+    def close(self):
+        self._rfile.close()
+        self._sock.close()
+
+
+class Client(object):
+    """Client for a L{Server}, with a pool of connections.
+
+    A client may be shared between threads; each call uses a connection
+    of its own.
+
+    """
+
+    def __init__(self, path, pool_size=4, timeout=None):
+        """@param path: path of the server's Unix socket.
+
+        @param pool_size: number of idle connections to keep open.
+
+        @param timeout: socket timeout in seconds, or None to block.
+
+        """
+        self._path = path
+        self._timeout = timeout
+        self._pool = queue.Queue(pool_size)
+
+    def _call(self, requests):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = _Connection(self._path, self._timeout)
+        results = []
+        error = None
+        try:
+            ids = [conn.send(*request) for request in requests]
+            for request_id in ids:
+                # Error responses still have to be read, to keep the
+                # connection in sync for the next call.
+                try:
+                    results.append(conn.receive(request_id))
+                except _ServerError as e:
+                    error = error or e
+                    results.append(None)
+        except Exception:
+            # Anything else may leave unread or partial responses.
+            conn.close()
+            raise
+        self._release(conn)
+        if error is not None:
+            raise error
+        return results
+
+    def _release(self, conn):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def get(self, table, key):
+        """Returns the value of key in table, or None."""
+        return self.get_many(table, [key])[0]
+
+    def get_many(self, table, keys):
+        """Looks up all keys in a single request.
+
+        @returns: a list of values, with None for keys that do not exist.
+
+        """
+        return self._call([(encode_get, table, keys)])[0]
+
+    def get_batches(self, table, batches):
+        """Sends one request per batch of keys, without waiting for the
+        responses in between.
+
+        @returns: a list with the result of L{get_many} for each batch.
+
+        """
+        return self._call([(encode_get, table, keys) for keys in batches])
+
+    def load(self, table, hashfile, logfile):
+        """Makes the server open a (new generation of a) table."""
+        self._call([(encode_load, table, hashfile, logfile)])
+
+    def ping(self):
+        self._call([(encode_ping,)])
+
+    def close(self):
+        """Closes all idle connections."""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def _parse_table(spec):
+    name, sep, files = spec.partition("=")
+    hashfile, sep2, logfile = files.partition(":")
+    if not sep or not sep2:
+        raise argparse.ArgumentTypeError(
+            "expected NAME=HASHFILE:LOGFILE, got %s" % spec)
+    return name, (hashfile, logfile)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m sparkey.server",
+        description="Serve sparkey lookups over a Unix socket.")
+    parser.add_argument("--socket", required=True, help="socket path")
+    parser.add_argument("--table", action="append", type=_parse_table,
+                        default=[], metavar="NAME=HASHFILE:LOGFILE",
+                        help="table to serve, may be repeated")
+    parser.add_argument("--cache-size", type=int, default=0,
+                        help="lookup cache size in bytes per table")
+    args = parser.parse_args(argv)
+
+    server = Server(args.socket, dict(args.table), args.cache_size)
+    print("Serving %d tables on %s" % (len(args.table), args.socket),
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Call counters and latency histograms for readers and writers.
+
+A L{Stats} object is an observer: pass it (or C{stats=True}) to a reader
+or writer and it will be told about every operation. Readers and writers
+without observers are not instrumented at all.
+
+"""
+
+from builtins import object
+import time
+
+if hasattr(time, "perf_counter_ns"):
+    clock_ns = time.perf_counter_ns
+else:
+    _perf_counter = getattr(time, "perf_counter", time.time)
+
+    def clock_ns():
+        return int(_perf_counter() * 1e9)
+
+# Each power of two is split into 2^(_SUB_BITS - 1) linear buckets, which
+# gives a relative error of at most 1 / 2^(_SUB_BITS - 1).
+_SUB_BITS = 6
+_SUB_COUNT = 1 << _SUB_BITS
+_HALF_SUB_COUNT = _SUB_COUNT >> 1
+_BUCKETS = (64 - _SUB_BITS + 2) * _HALF_SUB_COUNT
+
+
+def _bucket_index(value):
+    if value < _SUB_COUNT:
+        return value
+    shift = value.bit_length() - _SUB_BITS
+    return (shift << (_SUB_BITS - 1)) + (value >> shift)
+
+
+def _bucket_value(index):
+    if index < _SUB_COUNT:
+        return index
+    shift = (index >> (_SUB_BITS - 1)) - 1
+    return (index - (shift << (_SUB_BITS - 1))) << shift
+
+
+class Histogram(object):
+    """A log-linear histogram of non-negative integers (HDR style).
+
+    Recording is a couple of integer operations and a list increment,
+    and memory use is constant regardless of how many values are
+    recorded.
+
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Removes all recorded values."""
+        self._counts = [0] * _BUCKETS
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        """Records a value, negative values are recorded as 0."""
+        if value < 0:
+            value = 0
+        self._counts[_bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def percentile(self, p):
+        """Returns the value at the given percentile.
+
+        @param p: percentile in the range [0, 100].
+
+        @returns: the lower bound of the bucket holding the percentile
+                  (the exact maximum for the last bucket), or None if
+                  nothing has been recorded.
+
+        """
+        if not self.count:
+            return None
+        target = max(1, int(round(self.count * p / 100.0)))
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= target:
+                if seen == self.count:
+                    return self.max
+                return max(_bucket_value(index), self.min)
+        return self.max
+
+    def snapshot(self, scale=1e-3):
+        """Returns a summary of the histogram as a dict.
+
+        @param scale: factor applied to all values, by default converting
+                      nanoseconds to microseconds.
+
+        """
+        if not self.count:
+            return {"count": 0}
+        return {"count": self.count,
+                "mean": self.total * scale / self.count,
+                "min": self.min * scale,
+                "p50": self.percentile(50) * scale,
+                "p90": self.percentile(90) * scale,
+                "p99": self.percentile(99) * scale,
+                "p999": self.percentile(99.9) * scale,
+                "max": self.max * scale}
+
+
+class OpStats(object):
+    """Counters for a single kind of operation."""
+
+    def __init__(self):
+        self.calls = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.latency = Histogram()
+
+    def snapshot(self):
+        return {"calls": self.calls,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written,
+                "latency_us": self.latency.snapshot()}
+
+
+class Stats(object):
+    """Collects call counts, hits/misses, bytes and latencies per operation.
+
+    Operations are named after the methods they measure: get, contains,
+    put, delete, flush and next (one entry read while iterating).
+    Byte counts are the lengths of the keys and values passed in or
+    returned, i.e. characters for str arguments.
+
+    A Stats object may be shared by several readers and writers to
+    aggregate them. Updates are not synchronized, so counts may be
+    slightly off when it is shared between threads.
+
+    """
+
+    def __init__(self):
+        self._ops = {}
+        self._exporters = []
+
+    def reset(self):
+        """Clears all counters and histograms."""
+        self._ops = {}
+
+    def op(self, name):
+        """Returns the L{OpStats} for an operation, creating it if needed."""
+        op = self._ops.get(name)
+        if op is None:
+            op = self._ops[name] = OpStats()
+        return op
+
+    def observe(self, op, key, value, elapsed_ns):
+        """Called by readers and writers after each operation.
+
+        @param op: name of the operation.
+
+        @param key: the key passed to the operation, or None.
+
+        @param value: the value passed to or returned by the operation;
+                      None for a get miss, a bool for contains.
+
+        @param elapsed_ns: time spent in the operation in nanoseconds.
+
+        """
+        stats = self._ops.get(op)
+        if stats is None:
+            stats = self.op(op)
+        stats.calls += 1
+        stats.latency.record(elapsed_ns)
+        if op == "get":
+            if value is None:
+                stats.misses += 1
+            else:
+                stats.hits += 1
+                stats.bytes_read += len(value)
+        elif op == "contains":
+            if value:
+                stats.hits += 1
+            else:
+                stats.misses += 1
+        elif op == "next":
+            stats.bytes_read += len(key) + len(value)
+        elif op == "put":
+            stats.bytes_written += len(key) + len(value)
+        elif op == "delete":
+            stats.bytes_written += len(key)
+
+    def snapshot(self):
+        """Returns all counters as a dict of operation name to dict."""
+        return dict((name, op.snapshot()) for name, op in self._ops.items())
+
+    def add_exporter(self, exporter):
+        """Registers a function to be called by L{export}.
+
+        @param exporter: called with the result of L{snapshot}, e.g. to
+                         forward the values to a metrics system.
+
+        """
+        self._exporters.append(exporter)
+
+    def remove_exporter(self, exporter):
+        self._exporters.remove(exporter)
+
+    def export(self, reset=False):
+        """Passes a snapshot to all registered exporters.
+
+        @param reset: if True, clears all counters afterwards so that each
+                      export covers the time since the previous one.
+
+        @returns: the exported snapshot.
+
+        """
+        snapshot = self.snapshot()
+        for exporter in self._exporters:
+            exporter(snapshot)
+        if reset:
+            self.reset()
+        return snapshot
@@ -0,0 +1,637 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A mutable store built from immutable sparkey runs.
+
+    with TieredStore("/data/table") as store:
+        store.put(key, value)
+        store.delete(other_key)
+        value = store.get(key)
+
+Writes go to an in-memory memtable, and to a write-ahead log. With the
+default sync policy every write is flushed to the log before it returns,
+so it survives a crash of the process; with FSYNC it also survives a
+crash of the machine, and with NONE only a clean close. A full memtable is written out as a run, which is a
+pair of sparkey hash and log files. Lookups check the memtable, then the
+runs from newest to oldest.
+
+Runs are organized in levels. Level 0 holds the runs flushed from the
+memtable. Once it has level0_runs runs, they are merged with the single
+run of level 1. Each deeper level holds at most one run, and is merged
+into the next level once it grows past memtable_limit * fanout ** level
+bytes. A lookup therefore reads at most level0_runs + number of levels
+runs. Compaction runs in a background thread.
+
+Values in runs are prefixed by one byte that tells puts from deletes,
+so a delete can hide older values of the key in lower levels. Deletes
+are dropped once they are merged into the last level.
+
+The list of runs is kept in a JSON manifest, which is replaced
+atomically whenever the runs change.
+
+"""
+
+from builtins import object
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+
+import sparkey
+from sparkey.durability import NONE, FLUSH, FSYNC
+
+MANIFEST = "MANIFEST"
+
+_PUT = b"\x01"
+_TOMBSTONE = b"\x00"
+
+_RUN_FILE = re.compile(r"^run-(\d+)\.(spi|spl|bloom)$")
+_WAL_FILE = re.compile(r"^wal-(\d+)\.spl$")
+
+# Marks a deleted key in the memtable.
+_DELETED = object()
+_MISSING = object()
+
+
+def _run_name(run_id):
+    return "run-%08d" % run_id
+
+
+class _Bloom(object):
+    """A Bloom filter over the keys of a run."""
+
+    _header = struct.Struct("<QI")
+
+    def __init__(self, bits, hashes, data=None):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray((bits + 7) // 8) if data is None else data
+
+    @classmethod
+    def for_keys(cls, keys, bits_per_key):
+        """Returns an empty filter sized for the given number of keys."""
+        # ln(2) * bits per key hashes minimizes the false positive rate.
+        hashes = max(1, int(round(bits_per_key * 0.69)))
+        return cls(max(64, keys * bits_per_key), hashes)
+
+    def _positions(self, key):
+        a, b = struct.unpack(
+            "<QQ", hashlib.blake2b(key, digest_size=16).digest())
+        bits = self.bits
+        for i in range(self.hashes):
+            yield (a + i * b) % bits
+
+    def add(self, key):
+        data = self.data
+        for p in self._positions(key):
+            data[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, key):
+        data = self.data
+        for p in self._positions(key):
+            if not data[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self._header.pack(self.bits, self.hashes))
+            f.write(self.data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            bits, hashes = cls._header.unpack(f.read(cls._header.size))
+            return cls(bits, hashes, bytearray(f.read()))
+
+
+class _Run(object):
+    """An immutable hash and log file pair, with an optional filter."""
+
+    def __init__(self, directory, name):
+        self.name = name
+        base = os.path.join(directory, name)
+        self.hashfile = base + ".spi"
+        self.logfile = base + ".spl"
+        self.bloomfile = base + ".bloom"
+        self.reader = sparkey.HashReader(self.hashfile, self.logfile)
+        self.bloom = None
+        if os.path.exists(self.bloomfile):
+            self.bloom = _Bloom.load(self.bloomfile)
+        self.size = os.path.getsize(self.logfile)
+        # Lookups in progress, and what to do once there are none left.
+        # Both are guarded by the store's lock.
+        self.users = 0
+        self._dispose = None
+
+    def might_contain(self, key):
+        return self.bloom is None or key in self.bloom
+
+    def get(self, key):
+        """Returns the tagged value of key, or None."""
+        if self.bloom is not None and key not in self.bloom:
+            return None
+        # A pooled iterator of its own, so lookups can run concurrently.
+        with self.reader.iteritems() as iterator:
+            return iterator.get(key)
+
+    def release(self):
+        self.users -= 1
+        if not self.users and self._dispose is not None:
+            self._dispose()
+
+    def retire(self, remove):
+        """Closes the run, and removes its files if remove is True, once
+        no lookup uses it."""
+        self._dispose = self.remove if remove else self.close
+        if not self.users:
+            self._dispose()
+
+    def close(self):
+        self.reader.close()
+
+    def remove(self):
+        self.close()
+        for path in (self.hashfile, self.logfile, self.bloomfile):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def info(self):
+        return {"name": self.name,
+                "entries": len(self.reader),
+                "bytes": self.size,
+                "bloom": self.bloom is not None}
+
+
+class TieredStore(sparkey._Closeable):
+    """A mutable key-value store made of a memtable and sparkey runs.
+
+    This is threadsafe, but only one TieredStore may use a directory at
+    a time. Lookups in runs run concurrently, and do not wait for writes
+    that flush or fsync the write-ahead log.
+
+    """
+
+    def __init__(self, directory, memtable_limit=64 << 20, level0_runs=4,
+                 fanout=10, bloom_bits_per_key=0, wal=True, sync=FLUSH,
+                 background=True, compression_type=sparkey.Compression.NONE,
+                 compression_block_size=0, hash_size=0):
+        """Opens a store, creating it if the directory does not exist.
+
+        @param directory: directory holding the store's files.
+
+        @param memtable_limit: approximate size in bytes of the keys and
+                               values in the memtable before it is
+                               written out as a run.
+
+        @param level0_runs: number of runs flushed from the memtable that
+                            are merged into level 1 at once.
+
+        @param fanout: growth factor of the size of each level.
+
+        @param bloom_bits_per_key: if non-zero, runs get a Bloom filter
+                                   with this many bits per key, which
+                                   saves reading runs that do not have
+                                   the key. 10 gives about 1% false
+                                   positives.
+
+        @param wal: if False, writes are not logged, and the ones that
+                    have not been flushed to a run are lost if the store
+                    is not closed.
+
+        @param sync: when writes reach the write-ahead log.
+                     L{sparkey.durability.NONE} leaves them buffered
+                     until the memtable is flushed or the store is
+                     closed, L{sparkey.durability.FLUSH} flushes the log
+                     on every write, and L{sparkey.durability.FSYNC}
+                     also fsyncs it.
+
+        @param background: if False, compaction only happens in
+                           L{compact}.
+
+        @param compression_type: compression of runs, see L{LogWriter}.
+
+        @param compression_block_size: see L{LogWriter}.
+
+        @param hash_size: see L{HashWriter}.
+
+        """
+        self._directory = directory
+        self._memtable_limit = memtable_limit
+        self._level0_runs = level0_runs
+        self._fanout = fanout
+        self._bloom_bits_per_key = bloom_bits_per_key
+        if sync not in (NONE, FLUSH, FSYNC):
+            raise sparkey.SparkeyException(
+                "sync must be one of %r, %r and %r" % (NONE, FLUSH, FSYNC))
+        self._use_wal = wal
+        self._sync = sync
+        self._compression_type = compression_type
+        self._compression_block_size = compression_block_size
+        self._hash_size = hash_size
+
+        self._lock = threading.RLock()
+        # Orders writes to the write-ahead log, and their syncs, without
+        # holding up lookups. Taken before _lock.
+        self._wal_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._compaction_lock = threading.Lock()
+        self._memtable = {}
+        self._memtable_bytes = 0
+        self._frozen = None
+        self._wal = None
+        self._levels = [[]]
+        self._closed = False
+        self._compaction_error = None
+        self._thread = None
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._open()
+
+        if background:
+            self._compaction_due = threading.Event()
+            self._thread = threading.Thread(target=self._compact_forever,
+                                            name="sparkey-compaction")
+            self._thread.daemon = True
+            self._thread.start()
+            self._compaction_due.set()
+
+    # Opening and persistence
+
+    def _path(self, name):
+        return os.path.join(self._directory, name)
+
+    def _open(self):
+        manifest = {"version": 1, "next_id": 0, "levels": [[]]}
+        path = self._path(MANIFEST)
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            if manifest.get("version") != 1:
+                raise sparkey.SparkeyException(
+                    "Unsupported manifest version in %s" % path)
+        self._next_id = manifest["next_id"]
+        self._levels = [[_Run(self._directory, name) for name in level]
+                        for level in manifest["levels"]]
+        live = set(run.name for level in self._levels for run in level)
+
+        wals = []
+        for filename in os.listdir(self._directory):
+            match = _RUN_FILE.match(filename)
+            if match and "run-" + match.group(1) not in live:
+                # Left behind by a flush or compaction that did not finish.
+                os.remove(self._path(filename))
+            match = _WAL_FILE.match(filename)
+            if match:
+                wals.append(int(match.group(1)))
+        wals.sort()
+        if wals:
+            self._next_id = max(self._next_id, wals[-1] + 1)
+
+        self._memtable_id = self._allocate_id()
+        if self._use_wal:
+            self._wal = self._open_wal(self._memtable_id)
+        for wal_id in wals:
+            if _run_name(wal_id) not in live:
+                self._replay(self._path("wal-%08d.spl" % wal_id))
+        if self._memtable:
+            self.flush()
+        for wal_id in wals:
+            os.remove(self._path("wal-%08d.spl" % wal_id))
+
+    def _replay(self, path):
+        with sparkey.LogReader(path) as log:
+            for key, value, _ in log:
+                self._set(key, None if value[:1] == _TOMBSTONE else value[1:])
+
+    def _allocate_id(self):
+        with self._lock:
+            run_id = self._next_id
+            self._next_id += 1
+            return run_id
+
+    def _open_wal(self, wal_id):
+        return sparkey.LogWriter(self._path("wal-%08d.spl" % wal_id))
+
+    def _save_manifest(self):
+        # Called with the lock held.
+        manifest = {"version": 1,
+                    "next_id": self._next_id,
+                    "levels": [[run.name for run in level]
+                               for level in self._levels]}
+        path = self._path(MANIFEST)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        sparkey._fsync_dir(path)
+
+    def _write_run(self, run_id, entries, count):
+        """Writes (key, tagged value) pairs as a new run."""
+        name = _run_name(run_id)
+        base = self._path(name)
+        bloom = None
+        if self._bloom_bits_per_key:
+            bloom = _Bloom.for_keys(count, self._bloom_bits_per_key)
+        writer = sparkey.HashWriter(
+            base + ".spi", base + ".spl",
+            compression_type=self._compression_type,
+            compression_block_size=self._compression_block_size,
+            hash_size=self._hash_size)
+        try:
+            for key, value in entries:
+                writer.put(key, value)
+                if bloom is not None:
+                    bloom.add(key)
+            writer.flush(fsync=True)
+        finally:
+            writer.close()
+        if bloom is not None:
+            bloom.save(base + ".bloom")
+        return _Run(self._directory, name)
+
+    # Reads and writes
+
+    def _assert_open(self):
+        if self._closed:
+            raise sparkey.SparkeyException("Store is closed")
+
+    def _set(self, key, value):
+        old = self._memtable.get(key, _MISSING)
+        if old is not _MISSING:
+            self._memtable_bytes -= len(key) + (0 if old is _DELETED
+                                                else len(old))
+        if value is None:
+            value = _DELETED
+        self._memtable[key] = value
+        self._memtable_bytes += len(key) + (0 if value is _DELETED
+                                            else len(value))
+
+    def _sync_wal(self):
+        # Called with the WAL lock held.
+        if self._wal is not None and self._sync != NONE:
+            self._wal.flush(fsync=self._sync == FSYNC)
+
+    def put(self, key, value):
+        """Sets the value of a key."""
+        key = sparkey._to_bytes(key, "key")
+        value = sparkey._to_bytes(value, "value")
+        with self._wal_lock:
+            with self._lock:
+                self._assert_open()
+                if self._wal is not None:
+                    self._wal.put(key, _PUT + value)
+                self._set(key, value)
+                full = self._memtable_bytes >= self._memtable_limit
+            self._sync_wal()
+        if full:
+            self._flush(True)
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def delete(self, key):
+        """Deletes a key, if it exists."""
+        key = sparkey._to_bytes(key, "key")
+        with self._wal_lock:
+            with self._lock:
+                self._assert_open()
+                if self._wal is not None:
+                    self._wal.put(key, _TOMBSTONE)
+                self._set(key, None)
+                full = self._memtable_bytes >= self._memtable_limit
+            self._sync_wal()
+        if full:
+            self._flush(True)
+
+    def __delitem__(self, key):
+        self.delete(key)
+
+    def get(self, key):
+        """Returns the value of key, or None if it does not exist."""
+        key = sparkey._to_bytes(key, "key")
+        with self._lock:
+            self._assert_open()
+            for memtable in (self._memtable, self._frozen):
+                if memtable:
+                    value = memtable.get(key, _MISSING)
+                    if value is not _MISSING:
+                        return None if value is _DELETED else value
+            runs = [run for level in self._levels for run in level]
+            for run in runs:
+                run.users += 1
+        try:
+            for run in runs:
+                value = run.get(key)
+                if value is not None:
+                    return value[1:] if value[:1] == _PUT else None
+            return None
+        finally:
+            with self._lock:
+                for run in runs:
+                    run.release()
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def flush(self):
+        """Writes the memtable out as a new run.
+
+        Lookups and writes from other threads continue meanwhile.
+
+        """
+        self._flush(False)
+
+    def _flush(self, only_if_full):
+        with self._flush_lock:
+            with self._wal_lock, self._lock:
+                self._assert_open()
+                if not self._memtable:
+                    return
+                if (only_if_full
+                        and self._memtable_bytes < self._memtable_limit):
+                    # Another thread flushed it first.
+                    return
+                frozen_id, frozen = self._memtable_id, self._memtable
+                self._frozen = frozen
+                self._memtable = {}
+                self._memtable_bytes = 0
+                self._memtable_id = self._allocate_id()
+                old_wal = self._wal
+                if old_wal is not None:
+                    self._wal = self._open_wal(self._memtable_id)
+            if old_wal is not None:
+                old_wal.close()
+            entries = ((k, _TOMBSTONE if v is _DELETED else _PUT + v)
+                       for k, v in frozen.items())
+            run = self._write_run(frozen_id, entries, len(frozen))
+            with self._lock:
+                self._levels[0].insert(0, run)
+                self._frozen = None
+                self._save_manifest()
+            wal = self._path("wal-%08d.spl" % frozen_id)
+            if os.path.exists(wal):
+                os.remove(wal)
+        self._schedule_compaction()
+
+    # Compaction
+
+    def _schedule_compaction(self):
+        if self._thread is not None:
+            self._compaction_due.set()
+
+    def _plan(self):
+        """Returns the runs to merge, newest first, and the level to put
+        the result in, or None if no compaction is due."""
+        levels = self._levels
+        if len(levels[0]) >= self._level0_runs:
+            target = 1
+        else:
+            for target in range(2, len(levels) + 1):
+                level = levels[target - 1]
+                budget = self._memtable_limit * self._fanout ** (target - 1)
+                if level and level[0].size > budget:
+                    break
+            else:
+                return None
+        inputs = list(levels[target - 1])
+        if target < len(levels):
+            inputs.extend(levels[target])
+        return inputs, target
+
+    def _compact_step(self):
+        with self._lock:
+            self._assert_open()
+            plan = self._plan()
+            if plan is None:
+                return False
+            inputs, target = plan
+            # Deletes only matter if there is older data below the target.
+            keep_deletes = any(self._levels[target + 1:])
+            run_id = self._allocate_id()
+
+        run = self._merge(run_id, inputs, keep_deletes)
+
+        with self._lock:
+            for level in self._levels:
+                level[:] = [r for r in level if r not in inputs]
+            while len(self._levels) <= target:
+                self._levels.append([])
+            self._levels[target].append(run)
+            self._save_manifest()
+            for old in inputs:
+                old.retire(True)
+        return True
+
+    def _merge(self, run_id, inputs, keep_deletes):
+        # Separate readers, since the store's own are used for lookups.
+        readers = [sparkey.HashReader(r.hashfile, r.logfile) for r in inputs]
+
+        def entries():
+            for i, reader in enumerate(readers):
+                newer = list(zip(inputs[:i], readers[:i]))
+                for key, value in reader:
+                    if any(run.might_contain(key) and key in newer_reader
+                           for run, newer_reader in newer):
+                        continue
+                    if value[:1] == _TOMBSTONE and not keep_deletes:
+                        continue
+                    yield key, value
+
+        try:
+            return self._write_run(run_id, entries(),
+                                   sum(len(r) for r in readers))
+        finally:
+            for reader in readers:
+                reader.close()
+
+    def compact(self):
+        """Runs all due compactions in the calling thread."""
+        with self._compaction_lock:
+            while self._compact_step():
+                pass
+
+    def _compact_forever(self):
+        while True:
+            self._compaction_due.wait()
+            self._compaction_due.clear()
+            if self._closed:
+                return
+            try:
+                with self._compaction_lock:
+                    while not self._closed and self._compact_step():
+                        pass
+            except Exception as e:
+                if not self._closed:
+                    self._compaction_error = e
+                return
+
+    # Inspection and shutdown
+
+    def info(self):
+        """Returns the memtable size and the runs of each level as a
+        dict."""
+        with self._lock:
+            return {"memtable_entries": len(self._memtable),
+                    "memtable_bytes": self._memtable_bytes,
+                    "levels": [[run.info() for run in level]
+                               for level in self._levels]}
+
+    def close(self):
+        """Stops compaction and closes all files.
+
+        Writes still in the memtable are kept in the write-ahead log, and
+        read back the next time the store is opened. Without a
+        write-ahead log, they are flushed to a run.
+
+        @raise Exception: the error that stopped background compaction,
+                          if any.
+
+        """
+        if not self._use_wal and not self._closed:
+            self.flush()
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._thread is not None:
+            self._compaction_due.set()
+            self._thread.join()
+            self._thread = None
+        with self._compaction_lock, self._flush_lock:
+            with self._wal_lock, self._lock:
+                if self._wal is not None:
+                    self._wal.close()
+                    self._wal = None
+                for level in self._levels:
+                    for run in level:
+                        run.retire(False)
+        if self._compaction_error is not None:
+            raise self._compaction_error
@@ -0,0 +1,256 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Capture and replay of HashReader lookup traces.
+
+Capture a sample of the lookups done through a reader:
+
+    tracer = Tracer("lookups.trace", sample_rate=0.01)
+    reader.add_observer(tracer)
+    ...
+    reader.remove_observer(tracer)
+    tracer.close()
+
+and replay them against any store, offline:
+
+    python -m sparkey.trace replay lookups.trace store.spi store.spl
+
+A trace file starts with an 8 byte magic, followed by fixed size
+records of a u64 timestamp (ns since the epoch), the u64 L{key_digest}
+of the key, the u32 value length and a u8 of flags (L{FLAG_HIT},
+L{FLAG_CONTAINS}), all little-endian. Keys themselves are not stored.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+from builtins import object
+import argparse
+import collections
+import hashlib
+import json
+import struct
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import sparkey
+from sparkey.stats import Histogram, clock_ns
+
+MAGIC = b"SPKTRC01"
+FLAG_HIT = 1
+FLAG_CONTAINS = 2
+
+_record = struct.Struct("<QQIB")
+_digest = struct.Struct("<Q")
+_time_ns = getattr(time, "time_ns", None) or (lambda: int(time.time() * 1e9))
+
+TraceRecord = collections.namedtuple(
+    "TraceRecord", "timestamp_ns digest value_length hit contains")
+
+
+def key_digest(key):
+    """Returns the 64 bit digest used to identify a key in traces."""
+    key = sparkey._to_bytes(key, "key")
+    return _digest.unpack(hashlib.blake2b(key, digest_size=8).digest())[0]
+
+
+class Tracer(object):
+    """Observer that writes sampled get and contains calls to a trace file.
+
+    Records are handed to a background thread in batches, which does all
+    encoding and file IO. If it falls behind, batches are dropped rather
+    than slowing down lookups; see L{dropped}.
+
+    """
+
+    def __init__(self, path, sample_rate=1.0, batch_size=1024,
+                 max_pending=64):
+        """@param path: trace file to create.
+
+        @param sample_rate: fraction of lookups to record. Every n-th
+                            lookup is recorded, where n = 1 / sample_rate.
+
+        @param batch_size: number of records handed over at a time.
+
+        @param max_pending: number of batches that may wait for the
+                            writer thread before new ones are dropped.
+
+        """
+        self._period = max(1, int(round(1.0 / sample_rate)))
+        self._count = 0
+        self._batch = []
+        self._batch_size = batch_size
+        self._queue = queue.Queue(max_pending)
+        self.dropped = 0
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self._thread = threading.Thread(target=self._write_batches)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def observe(self, op, key, value, elapsed_ns):
+        if op == "get":
+            flags = 0 if value is None else FLAG_HIT
+            length = 0 if value is None else len(value)
+        elif op == "contains":
+            flags = FLAG_CONTAINS | (FLAG_HIT if value else 0)
+            length = 0
+        else:
+            return
+        self._count += 1
+        if self._count % self._period:
+            return
+        if type(key) is not bytes and type(key) is not str:
+            # Buffers may change before the writer thread gets to them.
+            key = sparkey._to_bytes(key, "key")
+        batch = self._batch
+        batch.append((_time_ns(), key, length, flags))
+        if len(batch) >= self._batch_size:
+            self._hand_over()
+
+    def _hand_over(self):
+        batch = self._batch
+        self._batch = []
+        try:
+            self._queue.put_nowait(batch)
+        except queue.Full:
+            self.dropped += len(batch)
+
+    def _write_batches(self):
+        pack = _record.pack
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                return
+            self._file.write(b"".join(
+                pack(ts, key_digest(key), length, flags)
+                for ts, key, length, flags in batch))
+
+    def close(self):
+        """Writes all pending records and closes the file."""
+        if self._thread is None:
+            return
+        if self._batch:
+            self._queue.put(self._batch)
+            self._batch = []
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+
+
+def read_trace(path):
+    """Yields the L{TraceRecord}s of a trace file."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise sparkey.SparkeyException("%s is not a trace file" % path)
+        size = _record.size
+        while True:
+            chunk = f.read(size * 4096)
+            if not chunk:
+                return
+            for i in range(0, len(chunk) - size + 1, size):
+                ts, digest, length, flags = _record.unpack_from(chunk, i)
+                yield TraceRecord(ts, digest, length, bool(flags & FLAG_HIT),
+                                  bool(flags & FLAG_CONTAINS))
+
+
+def frequencies(path):
+    """Returns a Counter of key digest to number of lookups in a trace.
+
+    Can be passed to L{sparkey.layout.optimize_layout} together with
+    C{key=key_digest}.
+
+    """
+    return collections.Counter(r.digest for r in read_trace(path))
+
+
+def replay(path, hashfile, logfile):
+    """Runs the lookups of a trace against a store, as fast as possible.
+
+    Digests are mapped back to keys by scanning the store once, so memory
+    use is proportional to the number of distinct keys in the trace.
+    Lookups of digests not in the store use keys that do not exist.
+
+    @returns: a dict with throughput, latency percentiles (in
+              microseconds) and hit counts.
+
+    """
+    wanted = set(r.digest for r in read_trace(path))
+    reader = sparkey.HashReader(hashfile, logfile)
+    try:
+        keys = {}
+        for key, _ in reader:
+            digest = key_digest(key)
+            if digest in wanted:
+                keys[digest] = key
+
+        latency = Histogram()
+        ops = hits = traced_hits = 0
+        get = reader.get
+        start = clock_ns()
+        for record in read_trace(path):
+            key = keys.get(record.digest)
+            if key is None:
+                key = b"\0sparkey-trace-miss-%d" % record.digest
+            t0 = clock_ns()
+            if record.contains:
+                hit = key in reader
+            else:
+                hit = get(key) is not None
+            latency.record(clock_ns() - t0)
+            ops += 1
+            hits += hit
+            traced_hits += record.hit
+        elapsed = (clock_ns() - start) / 1e9
+    finally:
+        reader.close()
+    return {"ops": ops,
+            "seconds": elapsed,
+            "ops_per_second": ops / elapsed if elapsed else None,
+            "hits": hits,
+            "traced_hits": traced_hits,
+            "distinct_keys": len(wanted),
+            "keys_found": len(keys),
+            "latency_us": latency.snapshot()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m sparkey.trace",
+        description="Work with sparkey lookup traces.")
+    commands = parser.add_subparsers(dest="command")
+    replay_parser = commands.add_parser(
+        "replay", help="replay a trace against a store")
+    replay_parser.add_argument("trace")
+    replay_parser.add_argument("hashfile")
+    replay_parser.add_argument("logfile")
+    args = parser.parse_args(argv)
+    if args.command != "replay":
+        parser.error("expected a command")
+    result = replay(args.trace, args.hashfile, args.logfile)
+    print(json.dumps(result, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fixed-width tables of int64 keys and NumPy records.
+
+Keys are stored as 8 byte little-endian integers and values as the raw
+bytes of a record of a fixed NumPy dtype. Reads and writes go straight
+between NumPy arrays and libsparkey, without creating a Python object per
+key or value:
+
+    writer = sparkey.LogWriter("table.spl")
+    TypedWriter(writer, dtype).put_many(ids, records)
+    writer.close()
+    sparkey.writehash("table.spi", "table.spl")
+
+    reader = TypedReader(sparkey.HashReader("table.spi", "table.spl"), dtype)
+    records, found = reader.get_many(ids)
+
+Requires numpy.
+
+"""
+
+from builtins import object
+import ctypes
+
+import numpy
+
+import sparkey
+
+KEY_DTYPE = numpy.dtype("<i8")
+_KEY_SIZE = KEY_DTYPE.itemsize
+
+
+def _keys(keys):
+    return numpy.ascontiguousarray(keys, dtype=KEY_DTYPE)
+
+
+class TypedWriter(object):
+    """Writes int64 keys and records of a fixed dtype to a L{LogWriter}.
+
+    If the writer has observers, or stats, entries go through its put and
+    delete methods so that they are counted. Otherwise they are written
+    straight to libsparkey.
+
+    """
+
+    def __init__(self, writer, dtype):
+        """@param writer: an open L{sparkey.LogWriter}.
+
+        @param dtype: NumPy dtype of the values, e.g. a structured dtype.
+
+        """
+        self._writer = writer
+        self.dtype = numpy.dtype(dtype)
+
+    def put(self, key, record):
+        """Appends a single key and record to the log."""
+        self.put_many([key], numpy.asarray([record], dtype=self.dtype))
+
+    def put_many(self, keys, records):
+        """Appends all keys and records, in order, to the log.
+
+        @param keys: array-like of int64 keys.
+
+        @param records: array-like of records of this writer's dtype,
+                        with the same length as keys.
+
+        """
+        keys = _keys(keys)
+        records = numpy.ascontiguousarray(records, dtype=self.dtype)
+        if len(keys) != len(records):
+            raise sparkey.SparkeyException(
+                "Got %d keys but %d records" % (len(keys), len(records)))
+        writer = self._writer
+        writer._assert_open()
+        if writer._observers:
+            # Go through put() so that observers see every entry.
+            for key, record in zip(keys, records):
+                writer.put(key.tobytes(), record.tobytes())
+            return
+        put = sparkey._native("_logwriter_put")
+        log = writer._log
+        size = self.dtype.itemsize
+        key_addr = keys.ctypes.data
+        value_addr = records.ctypes.data
+        for i in range(len(keys)):
+            put(log, _KEY_SIZE, key_addr + i * _KEY_SIZE,
+                size, value_addr + i * size)
+
+    def delete_many(self, keys):
+        """Appends delete operations for all keys to the log."""
+        keys = _keys(keys)
+        writer = self._writer
+        writer._assert_open()
+        if writer._observers:
+            for key in keys:
+                writer.delete(key.tobytes())
+            return
+        delete = sparkey._native("_logwriter_delete")
+        log = writer._log
+        key_addr = keys.ctypes.data
+        for i in range(len(keys)):
+            delete(log, _KEY_SIZE, key_addr + i * _KEY_SIZE)
+
+
+class TypedReader(object):
+    """Looks up int64 keys in a L{HashReader}, returning NumPy records.
+
+    If the reader has observers, or stats, lookups go through its get
+    method, and so are counted and use its lookup cache. Otherwise they
+    go straight to libsparkey. Like the reader, this must not be used
+    from several threads at once.
+
+    """
+
+    def __init__(self, reader, dtype):
+        """@param reader: an open L{sparkey.HashReader}.
+
+        @param dtype: NumPy dtype of the values.
+
+        """
+        self._reader = reader
+        self.dtype = numpy.dtype(dtype)
+
+    def get(self, key):
+        """Returns the record for key, or None if the key does not exist."""
+        records, found = self.get_many([key])
+        return records[0] if found[0] else None
+
+    def get_many(self, keys):
+        """Looks up all keys.
+
+        @param keys: array-like of int64 keys.
+
+        @returns: a tuple (records, found) of an array of this reader's
+                  dtype and a boolean array, both with one element per
+                  key. Records of keys that were not found are zeroed.
+
+        @raise SparkeyException: if a value does not have the size of
+                                 the dtype.
+
+        """
+        keys = _keys(keys)
+        n = len(keys)
+        size = self.dtype.itemsize
+        records = numpy.zeros(n, dtype=self.dtype)
+        found = numpy.zeros(n, dtype=numpy.bool_)
+
+        reader = self._reader
+        reader._assert_open()
+        if reader._observers:
+            for i in range(n):
+                value = reader.get(keys[i].tobytes())
+                if value is None:
+                    continue
+                if len(value) != size:
+                    raise sparkey.SparkeyException(
+                        "Value for key %d has length %d, expected %d" %
+                        (keys[i], len(value), size))
+                records[i] = numpy.frombuffer(value, dtype=self.dtype)[0]
+                found[i] = True
+            return records, found
+        hash_get = sparkey._native("_hash_get")
+        state = sparkey._native("_logiter_state")
+        valuelen = sparkey._native("_logiter_valuelen")
+        fill_value = sparkey._native("_logiter_fill_value")
+        hashreader = reader._reader
+        iterator = reader._iter._iter
+        log = reader._iter._log
+        active = sparkey.IterState.ACTIVE
+        length = ctypes.c_ulonglong()
+        length_ref = ctypes.byref(length)
+        key_addr = keys.ctypes.data
+        record_addr = records.ctypes.data
+        hits = found.view(numpy.uint8)
+
+        for i in range(n):
+            hash_get(hashreader, key_addr + i * _KEY_SIZE, _KEY_SIZE,
+                     iterator)
+            if state(iterator) != active:
+                continue
+            if valuelen(iterator) != size:
+                raise sparkey.SparkeyException(
+                    "Value for key %d has length %d, expected %d" %
+                    (keys[i], valuelen(iterator), size))
+            fill_value(iterator, log, size, record_addr + i * size,
+                       length_ref)
+            if length.value != size:
+                raise sparkey.SparkeyException(
+                    "Invalid length, expected %d but got %d" %
+                    (size, length.value))
+            hits[i] = 1
+        return records, found
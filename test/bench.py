@@ -15,74 +15,397 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+"""Benchmark suite for sparkey-python.
+
+Runs a set of workloads against freshly created stores and reports wall
+time, CPU time, throughput and latency percentiles. Results can be
+written as JSON to track regressions across releases:
+
+    PYTHONPATH=. python test/bench.py --entries 1000000 --json out.json
+
+Run with --help for all options.
+"""
+
 from __future__ import print_function
 from __future__ import division
-from past.utils import old_div
-import sparkey
-import tempfile
+
+import argparse
+import json
 import os
-import unittest
-import time
+import platform
+import random
+import shutil
 import sys
-from random import randint
-
-class TestBench(unittest.TestCase):
-
-  def getClock(self):
-      if sys.version_info >= (3, 0):
-          return time.process_time()
-      else:
-          return time.clock()
-
-  def setUp(self):
-    self.log_fd, self.logfile = tempfile.mkstemp()
-    self.hash_fd, self.hashfile = tempfile.mkstemp()
-
-  def tearDown(self):
-      os.remove(self.logfile)
-      os.remove(self.hashfile)
-
-  def _create(self, compression_type, num_entries):
-      writer = sparkey.LogWriter(self.logfile, compression_type=compression_type, compression_block_size=1024)
-      for i in range(0, num_entries):
-        writer.put("key_" + str(i), "value_" + str(i))
-      writer.close()
-      sparkey.writehash(self.hashfile, self.logfile)
-
-  def _random_access(self, num_entries, num_lookups):
-      reader = sparkey.HashReader(self.hashfile, self.logfile)
-      for i in range(0, num_lookups):
-        r = str(randint(0, num_entries - 1))
-        self.assertEqual("value_" + r, reader.getAsString('key_' + r))
-      reader.close()
-
-  def _test(self, compression_type, num_entries, num_lookups):
-      print("Testing bulk insert of %d elements and %d random lookups" % (num_entries, num_lookups))
-      print("  Candidate: Sparkey %s" % ("None" if compression_type == 0 else "Snappy"))
-      t1 = self.getClock()
-      self._create(compression_type, num_entries)
-      t2 = self.getClock()
-
-      print("    creation time (wall):      %2.2f" % (t2 - t1))
-      print("    throughput (puts/wallsec): %2.2f" % (old_div(num_entries, (t2 - t1))))
-      print("    file size:                 %d" % (os.stat(self.logfile).st_size + os.stat(self.hashfile).st_size))
-
-      self._random_access(num_entries, num_lookups)
-
-      t3 = self.getClock()
-      print("    lookup time (wall):           %2.2f" % (t3 - t2))
-      print("    throughput (lookups/wallsec): %2.2f" % (old_div(num_lookups, (t3 - t2))))
-
-  def testBench(self):
-    self._test(sparkey.Compression.NONE, 1000, 1000*1000)
-    self._test(sparkey.Compression.NONE, 1000*1000, 1000*1000)
-    self._test(sparkey.Compression.NONE, 10*1000*1000, 1000*1000)
-    self._test(sparkey.Compression.NONE, 100*1000*1000, 1000*1000)
-
-    self._test(sparkey.Compression.SNAPPY, 1000, 1000*1000)
-    self._test(sparkey.Compression.SNAPPY, 1000*1000, 1000*1000)
-    self._test(sparkey.Compression.SNAPPY, 10*1000*1000, 1000*1000)
-    self._test(sparkey.Compression.SNAPPY, 100*1000*1000, 1000*1000)
-
-if __name__ == '__main__': unittest.main()
+import tempfile
+import threading
+import time
+
+import sparkey
+
+_wall = getattr(time, "perf_counter", time.time)
+_cpu = getattr(time, "process_time", time.clock if hasattr(time, "clock")
+               else time.time)
+
+WORKLOADS = ("put", "bulk_put", "hash", "get_hit", "get_miss", "multiget",
+             "scan", "threaded_get")
+COMPRESSIONS = {"none": sparkey.Compression.NONE,
+                "snappy": sparkey.Compression.SNAPPY}
+
+
+def _key(i):
+    return b"key_%d" % i
+
+
+def _value(i, size):
+    v = b"value_%d_" % i
+    return (v * (size // len(v) + 1))[:size]
+
+
+def _zeta(n, theta):
+    # Exact for small n, Euler-Maclaurin approximation for large n.
+    limit = min(n, 100000)
+    total = sum(1.0 / (i ** theta) for i in range(1, limit + 1))
+    if n > limit:
+        a, b = float(limit), float(n)
+        total += ((b ** (1 - theta) - a ** (1 - theta)) / (1 - theta) +
+                  (b ** -theta - a ** -theta) / 2)
+    return total
+
+
+class UniformKeys(object):
+    """Key indices drawn uniformly from [0, n)."""
+
+    def __init__(self, n, rng):
+        self._n = n
+        self._rng = rng
+
+    def next(self):
+        return self._rng.randrange(self._n)
+
+
+class ZipfianKeys(object):
+    """Key indices drawn from a Zipfian distribution over [0, n).
+
+    Uses the algorithm from Gray et al, "Quickly Generating Billion-Record
+    Synthetic Databases" (as in YCSB). Ranks are scattered over the key
+    space so that hot keys are not all written next to each other.
+
+    """
+
+    def __init__(self, n, rng, theta=0.99):
+        self._n = n
+        self._rng = rng
+        self._theta = theta
+        self._zetan = _zeta(n, theta)
+        self._alpha = 1.0 / (1.0 - theta)
+        zeta2 = _zeta(2, theta)
+        self._eta = ((1 - (2.0 / n) ** (1 - theta)) /
+                     (1 - zeta2 / self._zetan))
+        self._half_pow_theta = 1 + 0.5 ** theta
+        # Multiplying by a prime is a bijection on [0, n) unless it divides n.
+        self._scatter = 2654435761 if n % 2654435761 else 1
+
+    def next(self):
+        u = self._rng.random()
+        uz = u * self._zetan
+        if uz < 1.0:
+            rank = 0
+        elif uz < self._half_pow_theta:
+            rank = 1
+        else:
+            rank = int(self._n * (self._eta * u - self._eta + 1)
+                       ** self._alpha)
+            rank = min(rank, self._n - 1)
+        return (rank * self._scatter) % self._n
+
+
+def _percentiles(samples):
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    n = len(samples)
+
+    def pick(p):
+        return samples[min(n - 1, int(p * n))] * 1e6
+
+    return {"p50_us": pick(0.50), "p90_us": pick(0.90),
+            "p99_us": pick(0.99), "p999_us": pick(0.999),
+            "max_us": samples[-1] * 1e6}
+
+
+class Timer(object):
+    def __enter__(self):
+        self.wall = _wall()
+        self.cpu = _cpu()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = _wall() - self.wall
+        self.cpu = _cpu() - self.cpu
+
+
+def _result(name, ops, timer, latencies=None, **extra):
+    res = {"workload": name, "ops": ops,
+           "wall_s": timer.wall, "cpu_s": timer.cpu,
+           "ops_per_wall_s": ops / timer.wall if timer.wall else None}
+    if latencies is not None:
+        res["latency"] = _percentiles(latencies)
+    res.update(extra)
+    return res
+
+
+class Bench(object):
+    def __init__(self, args, directory, compression):
+        self.args = args
+        self.compression = compression
+        self.logfile = os.path.join(directory, "bench.spl")
+        self.hashfile = os.path.join(directory, "bench.spi")
+        self.rng = random.Random(args.seed)
+
+    def _writer(self):
+        return sparkey.LogWriter(
+            self.logfile, compression_type=COMPRESSIONS[self.compression],
+            compression_block_size=self.args.block_size)
+
+    def _keys(self, n):
+        if self.args.distribution == "zipf":
+            return ZipfianKeys(n, self.rng, self.args.zipf_theta)
+        return UniformKeys(n, self.rng)
+
+    def _lookup_keys(self, offset):
+        dist = self._keys(self.args.entries)
+        return [_key(dist.next() + offset) for _ in range(self.args.lookups)]
+
+    def _timed_gets(self, reader, keys):
+        # Only every n-th lookup is timed individually, to keep the timer
+        # overhead out of the throughput numbers.
+        mask = self.args.latency_sample - 1
+        latencies = []
+        get = reader.get
+        with Timer() as t:
+            for i, key in enumerate(keys):
+                if i & mask == 0:
+                    t0 = _wall()
+                    get(key)
+                    latencies.append(_wall() - t0)
+                else:
+                    get(key)
+        return t, latencies
+
+    def put(self):
+        size = self.args.value_size
+        n = self.args.entries
+        with Timer() as t:
+            writer = self._writer()
+            for i in range(n):
+                writer.put(_key(i), _value(i, size))
+            writer.close()
+        return _result("put", n, t)
+
+    def bulk_put(self):
+        size = self.args.value_size
+        n = self.args.entries
+        items = [(_key(i), _value(i, size)) for i in range(n)]
+        with Timer() as t:
+            writer = self._writer()
+            put = writer.put
+            for key, value in items:
+                put(key, value)
+            writer.close()
+        return _result("bulk_put", n, t,
+                       log_bytes=os.path.getsize(self.logfile))
+
+    def hash(self):
+        with Timer() as t:
+            sparkey.writehash(self.hashfile, self.logfile)
+        return _result("hash", self.args.entries, t,
+                       hash_bytes=os.path.getsize(self.hashfile))
+
+    def _ensure_store(self):
+        # Read workloads can be run on their own, without put and hash.
+        if not os.path.exists(self.logfile):
+            size = self.args.value_size
+            writer = self._writer()
+            for i in range(self.args.entries):
+                writer.put(_key(i), _value(i, size))
+            writer.close()
+        if not os.path.exists(self.hashfile):
+            sparkey.writehash(self.hashfile, self.logfile)
+
+    def get_hit(self):
+        self._ensure_store()
+        keys = self._lookup_keys(0)
+        reader = sparkey.HashReader(self.hashfile, self.logfile)
+        t, latencies = self._timed_gets(reader, keys)
+        reader.close()
+        return _result("get_hit", len(keys), t, latencies)
+
+    def get_miss(self):
+        self._ensure_store()
+        keys = self._lookup_keys(self.args.entries)
+        reader = sparkey.HashReader(self.hashfile, self.logfile)
+        t, latencies = self._timed_gets(reader, keys)
+        reader.close()
+        return _result("get_miss", len(keys), t, latencies)
+
+    def multiget(self):
+        self._ensure_store()
+        keys = self._lookup_keys(0)
+        batch = self.args.batch
+        batches = [keys[i:i + batch] for i in range(0, len(keys), batch)]
+        reader = sparkey.HashReader(self.hashfile, self.logfile)
+        get = reader.get
+        latencies = []
+        with Timer() as t:
+            for keys_ in batches:
+                t0 = _wall()
+                [get(k) for k in keys_]
+                latencies.append(_wall() - t0)
+        reader.close()
+        return _result("multiget", len(keys), t, latencies, batch=batch)
+
+    def scan(self):
+        self._ensure_store()
+        reader = sparkey.HashReader(self.hashfile, self.logfile)
+        count = 0
+        with Timer() as t:
+            for _ in reader:
+                count += 1
+        reader.close()
+        return _result("scan", count, t)
+
+    def threaded_get(self):
+        self._ensure_store()
+        threads = self.args.threads
+        keys = self._lookup_keys(0)
+        per_thread = [keys[i::threads] for i in range(threads)]
+        latencies = [[] for _ in range(threads)]
+        # HashReader is not threadsafe, so each thread gets its own. The
+        # files are mapped, so this does not duplicate any data.
+        readers = [sparkey.HashReader(self.hashfile, self.logfile)
+                   for _ in range(threads)]
+
+        def work(i):
+            latencies[i] = self._timed_gets(readers[i], per_thread[i])[1]
+
+        workers = [threading.Thread(target=work, args=(i,))
+                   for i in range(threads)]
+        with Timer() as t:
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+        for reader in readers:
+            reader.close()
+        return _result("threaded_get", len(keys), t,
+                       sum(latencies, []), threads=threads)
+
+    def run(self, workloads, out):
+        results = []
+        for name in workloads:
+            res = getattr(self, name)()
+            res["compression"] = self.compression
+            results.append(res)
+            _print(res, out)
+        return results
+
+
+def _print(res, out):
+    line = "  %-8s %-12s ops=%-10d wall=%8.3fs cpu=%8.3fs" % (
+        res["compression"], res["workload"], res["ops"], res["wall_s"],
+        res["cpu_s"])
+    if res["ops_per_wall_s"]:
+        line += " %12.0f ops/s" % res["ops_per_wall_s"]
+    lat = res.get("latency")
+    if lat:
+        line += "  p50=%.1fus p99=%.1fus p999=%.1fus" % (
+            lat["p50_us"], lat["p99_us"], lat["p999_us"])
+    print(line, file=out)
+    out.flush()
+
+
+def _machine():
+    return {"python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count() if hasattr(os, "cpu_count") else None,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description="sparkey benchmarks")
+    parser.add_argument("--entries", type=int, default=100000,
+                        help="number of entries to write")
+    parser.add_argument("--lookups", type=int, default=100000,
+                        help="number of lookups per read workload")
+    parser.add_argument("--value-size", type=int, default=16,
+                        help="size of each value in bytes")
+    parser.add_argument("--distribution", choices=("uniform", "zipf"),
+                        default="uniform", help="lookup key distribution")
+    parser.add_argument("--zipf-theta", type=float, default=0.99,
+                        help="skew of the zipf distribution, in (0, 1)")
+    parser.add_argument("--compression", default="none,snappy",
+                        help="comma separated list of: none, snappy")
+    parser.add_argument("--block-size", type=int, default=1024,
+                        help="compression block size")
+    parser.add_argument("--batch", type=int, default=100,
+                        help="keys per multiget batch")
+    parser.add_argument("--threads", type=int, default=4,
+                        help="reader threads for threaded_get")
+    parser.add_argument("--latency-sample", type=int, default=16,
+                        help="time every n-th lookup, must be a power of 2")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS),
+                        help="comma separated list of workloads")
+    parser.add_argument("--seed", type=int, default=4711)
+    parser.add_argument("--dir", default=None,
+                        help="directory for temporary files")
+    parser.add_argument("--json", default=None,
+                        help="write results as JSON to this file, "
+                             "or - for stdout")
+    args = parser.parse_args(argv)
+    if (args.latency_sample < 1
+            or args.latency_sample & (args.latency_sample - 1)):
+        parser.error("--latency-sample must be a positive power of 2")
+    args.workloads = [w for w in args.workloads.split(",") if w]
+    for w in args.workloads:
+        if w not in WORKLOADS:
+            parser.error("unknown workload %s" % w)
+    args.compression = [c for c in args.compression.split(",") if c]
+    for c in args.compression:
+        if c not in COMPRESSIONS:
+            parser.error("unknown compression %s" % c)
+    return args
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    # Keeps stdout clean for the JSON document.
+    out = sys.stderr if args.json == "-" else sys.stdout
+    results = []
+    for compression in args.compression:
+        directory = tempfile.mkdtemp(dir=args.dir)
+        try:
+            print("%d entries, %d lookups (%s), compression %s" % (
+                args.entries, args.lookups, args.distribution, compression),
+                file=out)
+            results.extend(Bench(args, directory, compression)
+                           .run(args.workloads, out))
+        finally:
+            shutil.rmtree(directory)
+
+    if args.json:
+        config = dict(vars(args))
+        config.pop("json")
+        config.pop("dir")
+        doc = {"machine": _machine(), "config": config, "results": results}
+        if args.json == "-":
+            json.dump(doc, sys.stdout, indent=2, sort_keys=True)
+            print()
+        else:
+            with open(args.json, "w") as f:
+                json.dump(doc, f, indent=2, sort_keys=True)
+
 
+if __name__ == "__main__":
+    main()
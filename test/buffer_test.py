@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import array
+import sparkey
+import tempfile
+import os
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Text(str):
+    pass
+
+
+class TestBuffer(unittest.TestCase):
+    def setUp(self):
+        self.logfile = tempfile.mkstemp()[1]
+        self.hashfile = tempfile.mkstemp()[1]
+
+    def tearDown(self):
+        os.remove(self.logfile)
+        os.remove(self.hashfile)
+
+    def test_buffers(self):
+        data = b'xxkey0value0key1value1'
+        view = memoryview(data)
+        writer = sparkey.HashWriter(self.hashfile, self.logfile)
+        writer.put(view[2:6], view[6:12])
+        writer.put(bytearray(b'key1'), array.array('b', b'value1'))
+        writer.delete(memoryview(bytearray(b'key2')))
+        writer.close()
+
+        reader = sparkey.HashReader(self.hashfile, self.logfile)
+        self.assertEqual(b'value0', reader.get(bytearray(b'key0')))
+        self.assertEqual(b'value1', reader[view[12:16]])
+        self.assertTrue(bytearray(b'key0') in reader)
+        self.assertTrue(view[12:16] in reader)
+        self.assertFalse(memoryview(b'key2') in reader)
+        self.assertTrue('key0' in reader)
+        reader.close()
+
+    def test_invalid(self):
+        writer = sparkey.LogWriter(self.logfile)
+        self.assertRaises(sparkey.SparkeyException, writer.put, 1, b'value')
+        self.assertRaises(sparkey.SparkeyException, writer.put,
+                          memoryview(b'abcd')[::2], b'value')
+        writer.close()
+
+    def test_str_subclass(self):
+        self.assertEqual(b'key', sparkey._to_bytes(Text('key'), 'key'))
+        self.assertEqual(3, sparkey._to_buffer(Text('key'), 'key')[1])
+        if numpy is not None:
+            key = numpy.array(['k\xe9y'])[0]
+            self.assertEqual(b'k\xc3\xa9y', sparkey._to_bytes(key, 'key'))
+            self.assertEqual((b'k\xc3\xa9y', 4),
+                             sparkey._to_buffer(key, 'key'))
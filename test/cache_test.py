@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sparkey
+import sparkey.cache
+import tempfile
+import os
+import unittest
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_eviction(self):
+        cache = sparkey.cache.LRUCache(1000)
+        for i in range(0, 100):
+            cache.put(b'key%d' % i, b'value%d' % i)
+        self.assertTrue(cache.bytes <= 1000)
+        self.assertTrue(cache.evictions > 0)
+        self.assertEqual(b'value99', cache.get(b'key99'))
+        self.assertTrue(cache.get(b'key0') is sparkey.cache.MISSING)
+        info = cache.info()
+        self.assertEqual(1, info['hits'])
+        self.assertEqual(1, info['misses'])
+        self.assertEqual(0.5, info['hit_rate'])
+
+    def test_recently_used_is_kept(self):
+        cache = sparkey.cache.LRUCache(1000)
+        cache.put(b'first', None)
+        for i in range(0, 100):
+            cache.get(b'first')
+            cache.put(b'key%d' % i, b'value%d' % i)
+        self.assertEqual(None, cache.get(b'first'))
+
+
+class TestCachedReader(unittest.TestCase):
+    def setUp(self):
+        self.logfile = tempfile.mkstemp()[1]
+        self.hashfile = tempfile.mkstemp()[1]
+
+    def tearDown(self):
+        os.remove(self.logfile)
+        os.remove(self.hashfile)
+
+    def test_snappy(self):
+        writer = sparkey.HashWriter(
+            self.hashfile, self.logfile,
+            compression_type=sparkey.Compression.SNAPPY,
+            compression_block_size=1024)
+        for i in range(0, 100):
+            writer.put('key%d' % i, 'value%d' % i)
+        writer.close()
+
+        reader = sparkey.HashReader(self.hashfile, self.logfile,
+                                    cache_size=1 << 20)
+        for _ in range(0, 3):
+            for i in range(0, 100):
+                self.assertEqual(b'value%d' % i, reader['key%d' % i])
+            self.assertEqual(None, reader.get('missing'))
+        info = reader.cache_info()
+        self.assertEqual(101, info['misses'])
+        self.assertEqual(202, info['hits'])
+        reader.close()
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sparkey
+from sparkey import __main__ as cli
+import io
+import tempfile
+import os
+import shutil
+import sys
+import unittest
+
+records = [(b'plain', b'value'),
+           (b'tab\tkey', b'new\nline'),
+           (b'back\\slash', b'\\t not a tab\r'),
+           (b'\xff\xfe', b'')]
+
+
+class TestFormats(unittest.TestCase):
+    def roundtrip(self, fmt):
+        f = io.BytesIO()
+        for key, value in records:
+            cli.write_record(f, fmt, key, value)
+        f.seek(0)
+        self.assertEqual(records, list(cli.read_records(f, fmt)))
+
+    def test_tsv(self):
+        self.roundtrip('tsv')
+
+    def test_jsonl(self):
+        self.roundtrip('jsonl')
+
+    def test_binary(self):
+        self.roundtrip('binary')
+
+    def test_jsonl_delete(self):
+        f = io.BytesIO(b'{"key": "a", "value": null}\n')
+        self.assertEqual([(b'a', None)], list(cli.read_records(f, 'jsonl')))
+
+    def test_binary_truncated(self):
+        f = io.BytesIO()
+        cli.write_record(f, 'binary', b'key', b'value')
+        data = f.getvalue()
+        for end in (2, 5, 9, len(data) - 1):
+            self.assertRaises(sparkey.SparkeyException, list,
+                              cli.read_records(io.BytesIO(data[:end]),
+                                               'binary'))
+
+
+class TestCli(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.hashfile = os.path.join(self.dir, 'test.spi')
+        self.logfile = os.path.join(self.dir, 'test.spl')
+        self.input = os.path.join(self.dir, 'input.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_build(self):
+        with open(self.input, 'wb') as f:
+            for key, value in records:
+                cli.write_record(f, 'jsonl', key, value)
+            f.write(b'{"key": "plain", "value": null}\n')
+        self.assertEqual(0, cli.main(['build', self.hashfile, self.logfile,
+                                      '--input', self.input,
+                                      '--format', 'jsonl']))
+        reader = sparkey.HashReader(self.hashfile, self.logfile)
+        self.assertEqual(sorted(records[1:]), sorted(reader))
+        self.assertEqual(0, reader.num_collisions())
+        reader.close()
+
+    def test_mget_dumped_keys(self):
+        writer = sparkey.HashWriter(self.hashfile, self.logfile)
+        for key, value in records:
+            writer.put(key, value)
+        writer.close()
+        stdin, stdout = sys.stdin, sys.stdout
+        try:
+            sys.stdout = io.TextIOWrapper(io.BytesIO())
+            cli.main(['dump', self.hashfile, self.logfile])
+            dumped = sys.stdout.buffer.getvalue()
+            keys = b''.join(line.split(b'\t')[0] + b'\n'
+                            for line in dumped.splitlines())
+            sys.stdin = io.TextIOWrapper(io.BytesIO(keys))
+            sys.stdout = io.TextIOWrapper(io.BytesIO())
+            self.assertEqual(0, cli.main(['mget', self.hashfile,
+                                          self.logfile]))
+            self.assertEqual(dumped, sys.stdout.buffer.getvalue())
+        finally:
+            sys.stdin, sys.stdout = stdin, stdout
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sparkey
+from sparkey.diff import diff, ADDED, REMOVED, CHANGED
+import tempfile
+import os
+import shutil
+import unittest
+
+
+class TestDiff(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def store(self, name, entries, **kwargs):
+        hashfile = os.path.join(self.dir, name + '.spi')
+        logfile = os.path.join(self.dir, name + '.spl')
+        writer = sparkey.HashWriter(hashfile, logfile, **kwargs)
+        for key, value in entries:
+            writer.put(key, value)
+        writer.close()
+        return sparkey.HashReader(hashfile, logfile)
+
+    def test_diff(self):
+        old = self.store('old', [('same', 'x' * 1000), ('changed', 'abc'),
+                                 ('resized', 'abc'), ('removed', ''),
+                                 ('empty', '')])
+        new = self.store('new', [('same', 'x' * 1000), ('changed', 'abd'),
+                                 ('resized', 'abcd'), ('added', 'v'),
+                                 ('empty', '')],
+                         compression_type=sparkey.Compression.SNAPPY,
+                         compression_block_size=64)
+        self.assertEqual([(CHANGED, b'changed'), (CHANGED, b'resized'),
+                          (ADDED, b'added'), (REMOVED, b'removed')],
+                         list(diff(old, new)))
+        self.assertEqual([], list(diff(new, new)))
+        old.close()
+        new.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
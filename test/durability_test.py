@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sparkey
+from sparkey.durability import GroupCommitWriter, NONE, FSYNC
+import tempfile
+import os
+import shutil
+import threading
+import unittest
+
+
+class RecordingWriter(object):
+    """Records the calls made by the commit thread."""
+
+    def __init__(self):
+        self.calls = []
+
+    def put(self, key, value):
+        self.calls.append(('put', key, value))
+
+    def delete(self, key):
+        self.calls.append(('delete', key))
+
+    def flush(self, fsync=False):
+        self.calls.append(('flush', fsync))
+
+
+class RecordingHashWriter(RecordingWriter):
+    def flush_log(self, fsync=False):
+        self.calls.append(('flush_log', fsync))
+
+
+class TestGroupCommit(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.logfile = os.path.join(self.dir, 'test.spl')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_groups(self):
+        writer = RecordingWriter()
+        committer = GroupCommitWriter(writer, durability=FSYNC,
+                                      max_batch=4, max_delay=10)
+        futures = [committer.put('key%d' % i, 'value') for i in range(0, 8)]
+        futures.append(committer.delete('key0'))
+        for future in futures[:8]:
+            future.result()
+        committer.close()
+        self.assertTrue(futures[8].done())
+        self.assertEqual(['put'] * 4 + ['flush'] + ['put'] * 4 + ['flush'] +
+                         ['delete', 'flush'],
+                         [call[0] for call in writer.calls])
+        self.assertEqual(('flush', True), writer.calls[-1])
+        self.assertEqual({'groups': 3, 'writes': 9, 'mean_group_size': 3.0,
+                          'pending': 0}, committer.info())
+        self.assertRaises(sparkey.SparkeyException, committer.put, 'a', 'b')
+
+    def test_no_durability(self):
+        writer = RecordingWriter()
+        committer = GroupCommitWriter(writer, durability=NONE, max_delay=0)
+        committer.put('a', 'b').result()
+        self.assertEqual([('put', b'a', b'b')], writer.calls)
+        committer.flush().result()
+        self.assertEqual(('flush', False), writer.calls[-1])
+        committer.close()
+        self.assertRaises(sparkey.SparkeyException, GroupCommitWriter,
+                          writer, durability='sometimes')
+
+    def test_flushes_log_of_hash_writer(self):
+        writer = RecordingHashWriter()
+        committer = GroupCommitWriter(writer, durability=FSYNC, max_delay=0)
+        committer.put('a', 'b').result()
+        committer.close()
+        self.assertEqual([('put', b'a', b'b'), ('flush_log', True)],
+                         writer.calls)
+
+    def test_concurrent_producers(self):
+        with sparkey.LogWriter(self.logfile) as writer:
+            with GroupCommitWriter(writer, durability=FSYNC) as committer:
+                def produce(n):
+                    for i in range(0, 100):
+                        committer.put('key%d_%d' % (n, i), 'value')
+                threads = [threading.Thread(target=produce, args=(n,))
+                           for n in range(0, 4)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        with sparkey.LogReader(self.logfile) as reader:
+            self.assertEqual(400, len(list(reader)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sparkey
+import ctypes
+import tempfile
+import os
+import shutil
+import unittest
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+    from sparkey.export import export, _Batch
+except ImportError:
+    pyarrow = None
+
+
+def fake_fill(iterator, log, length, addr, got):
+    """Stands in for the native fill functions, with the iterator being
+    the bytes to copy."""
+    ctypes.memmove(addr, iterator, length)
+    got._obj.value = length
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class TestBatch(unittest.TestCase):
+    def fill(self, batch, entries):
+        for key, value in entries:
+            self.assertTrue(batch.fits(len(key), len(value)))
+            batch.keys.fill(fake_fill, key, None, len(key), batch.rows)
+            batch.values.fill(fake_fill, value, None, len(value),
+                              batch.rows)
+            batch.rows += 1
+        table = pyarrow.Table.from_batches([batch.to_arrow()])
+        return list(zip(table.column('key').to_pylist(),
+                        table.column('value').to_pylist()))
+
+    def test_grow_and_reuse(self):
+        batch = _Batch(1000, 1 << 20)
+        self.assertTrue(ctypes.sizeof(batch.values.data) < 1 << 20)
+        entries = [(b'key%d' % i, b'v' * (i * 100)) for i in range(0, 100)]
+        self.assertEqual(entries, self.fill(batch, entries))
+        self.assertFalse(batch.fits(0, 1 << 20))
+        batch.reset()
+        entries = [(b'other', b''), (b'', b'value')]
+        self.assertEqual(entries, self.fill(batch, entries))
+
+    def test_short_fill(self):
+        def short_fill(iterator, log, length, addr, got):
+            got._obj.value = length - 1
+        batch = _Batch(10, 100)
+        self.assertRaises(sparkey.SparkeyException, batch.keys.fill,
+                          short_fill, None, None, 5, 0)
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.hashfile = os.path.join(self.dir, 'test.spi')
+        self.logfile = os.path.join(self.dir, 'test.spl')
+        writer = sparkey.HashWriter(self.hashfile, self.logfile)
+        for i in range(0, 1000):
+            writer.put('key%d' % i, 'value%d' % i * (i % 10))
+        writer.delete('key5')
+        writer.put('large', 'x' * 5000)
+        writer.close()
+        self.expected = sorted(sparkey.HashReader(self.hashfile,
+                                                  self.logfile))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check(self, table):
+        self.assertEqual(self.expected,
+                         sorted(zip(table.column('key').to_pylist(),
+                                    table.column('value').to_pylist())))
+
+    def test_parquet(self):
+        path = os.path.join(self.dir, 'out.parquet')
+        result = export(self.hashfile, self.logfile, path,
+                        batch_rows=100, batch_bytes=1000)
+        self.assertEqual(1000, result['rows'])
+        self.assertTrue(result['batches'] > 10)
+        self.check(pyarrow.parquet.read_table(path))
+
+    def test_arrow(self):
+        path = os.path.join(self.dir, 'out.arrow')
+        export(self.hashfile, self.logfile, path)
+        with pyarrow.OSFile(path) as f:
+            self.check(pyarrow.ipc.open_file(f).read_all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sparkey
+import tempfile
+import os
+import unittest
+
+
+@unittest.skipIf(not hasattr(os, "fork"), "os.fork is not available")
+class TestFork(unittest.TestCase):
+    def setUp(self):
+        self.logfile = tempfile.mkstemp()[1]
+        self.hashfile = tempfile.mkstemp()[1]
+
+    def tearDown(self):
+        os.remove(self.logfile)
+        os.remove(self.hashfile)
+
+    def test_reader_shared_with_children(self):
+        writer = sparkey.HashWriter(self.hashfile, self.logfile)
+        for i in range(0, 100):
+            writer.put('key%d' % i, 'value%d' % i)
+        writer.close()
+
+        reader = sparkey.HashReader(self.hashfile, self.logfile, stats=True,
+                                    cache_size=1 << 16)
+        self.assertEqual(b'value0', reader['key0'])
+
+        children = []
+        for child in range(0, 4):
+            pid = os.fork()
+            if pid == 0:
+                ok = reader.stats() == {}
+                for i in range(child, 100, 4):
+                    ok = ok and reader.get('key%d' % i) == b'value%d' % i
+                ok = ok and len(list(reader)) == 100
+                os._exit(0 if ok else 1)
+            children.append(pid)
+
+        for pid in children:
+            self.assertEqual(0, os.waitpid(pid, 0)[1])
+        self.assertEqual(1, reader.stats()['get']['calls'])
+        reader.close()
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sparkey
+import tempfile
+import os
+import shutil
+import unittest
+
+
+class TestIterPool(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.hashfile = os.path.join(self.dir, 'test.spi')
+        self.logfile = os.path.join(self.dir, 'test.spl')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, n, **kwargs):
+        with sparkey.HashWriter(self.hashfile, self.logfile,
+                                **kwargs) as writer:
+            writer.delete('key0')
+            for i in range(0, n):
+                writer.put('key%d' % i, 'value%d' % i)
+            writer.delete('key1')
+        return [(b'key%d' % i, b'value%d' % i) for i in range(0, n) if i != 1]
+
+    def check_scans(self, expected):
+        with sparkey.HashReader(self.hashfile, self.logfile) as reader:
+            for _ in range(0, 3):
+                with reader.iteritems() as it:
+                    self.assertEqual(expected, list(it))
+                self.assertEqual(1, len(reader._iter_pool))
+            # Partial scans and lookups through an iterator.
+            with reader.iteritems() as it:
+                next(it)
+                self.assertEqual(b'value5', it.get('key5'))
+            with reader.iteritems() as it:
+                self.assertEqual(expected, list(it))
+            self.assertEqual(b'value7', reader['key7'])
+        self.assertEqual([], reader._iter_pool)
+
+    def test_reuse(self):
+        self.check_scans(self.write(100))
+
+    def test_reuse_compressed(self):
+        self.check_scans(self.write(100,
+                                    compression_type=sparkey.Compression.SNAPPY,
+                                    compression_block_size=64))
+
+    def test_empty(self):
+        self.check_scans(self.write(0))
+
+    def test_concurrent_iterators(self):
+        expected = self.write(10)
+        with sparkey.HashReader(self.hashfile, self.logfile) as reader:
+            its = [reader.iteritems() for _ in range(0, 10)]
+            self.assertEqual([expected] * 10, [list(it) for it in its])
+            for it in its:
+                it.close()
+            self.assertEqual(sparkey._ITER_POOL_SIZE, len(reader._iter_pool))
+
+    def test_log_reader(self):
+        self.write(3)
+        with sparkey.LogReader(self.logfile) as reader:
+            with iter(reader) as it:
+                self.assertEqual(5, len(list(it)))
+            self.assertEqual(None, it._iter)
+
+
+if __name__ == '__main__':
+    unittest.main()
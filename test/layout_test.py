@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sparkey
+from sparkey.layout import optimize_layout
+import tempfile
+import os
+import shutil
+import unittest
+
+
+class TestLayout(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.hashfile = os.path.join(self.dir, 'in.spi')
+        self.logfile = os.path.join(self.dir, 'in.spl')
+        self.out_hashfile = os.path.join(self.dir, 'out.spi')
+        self.out_logfile = os.path.join(self.dir, 'out.spl')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_hot_first(self):
+        writer = sparkey.HashWriter(
+            self.hashfile, self.logfile,
+            compression_type=sparkey.Compression.SNAPPY,
+            compression_block_size=256)
+        for i in range(0, 100):
+            writer.put('key%d' % i, 'value%d' % i)
+        writer.delete('key50')
+        writer.close()
+
+        result = optimize_layout(self.hashfile, self.logfile,
+                                 self.out_hashfile, self.out_logfile,
+                                 {'key90': 5, 'key10': 10, 'key50': 100})
+        self.assertEqual({'entries': 99, 'hot_entries': 2}, result)
+
+        reader = sparkey.HashReader(self.out_hashfile, self.out_logfile)
+        self.assertEqual(sparkey.Compression.SNAPPY,
+                         reader.compression_type())
+        keys = [k for k, _ in reader]
+        self.assertEqual([b'key10', b'key90', b'key0'], keys[:3])
+        self.assertEqual(99, len(keys))
+        self.assertEqual(b'value90', reader['key90'])
+        self.assertEqual(None, reader.get('key50'))
+        reader.close()
+
+    def test_in_place(self):
+        self.assertRaises(sparkey.SparkeyException, optimize_layout,
+                          self.hashfile, self.logfile, self.out_hashfile,
+                          self.logfile, {})
+        # The same hash file through a symlink.
+        link = os.path.join(self.dir, 'link.spi')
+        open(self.hashfile, 'w').close()
+        os.symlink(self.hashfile, link)
+        self.assertRaises(sparkey.SparkeyException, optimize_layout,
+                          self.hashfile, self.logfile, link,
+                          self.out_logfile, {})
+        self.assertEqual(0, os.path.getsize(self.hashfile))
@@ -0,0 +1,56 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(code, **env):
+    environ = dict(os.environ)
+    environ["PYTHONPATH"] = ROOT
+    environ.update(env)
+    return subprocess.call([sys.executable, "-c", code], env=environ)
+
+
+class TestLibrary(unittest.TestCase):
+    def test_import_does_not_load(self):
+        code = ("import sys, sparkey\n"
+                "sys.exit(sparkey._libsparkey is not None)")
+        self.assertEqual(0, _run(code))
+
+    def test_invalid_library_path(self):
+        code = ("import sys, sparkey\n"
+                "try:\n"
+                "    sparkey.writehash('a', 'b')\n"
+                "except sparkey.SparkeyException:\n"
+                "    sys.exit(0)\n"
+                "sys.exit(1)")
+        self.assertEqual(0, _run(code, SPARKEY_LIBRARY="/nonexistent.so"))
+
+    @unittest.skipIf(sys.version_info < (3, 7), "needs module __getattr__")
+    def test_libsparkey_attribute_loads(self):
+        code = ("import sys, sparkey\n"
+                "try:\n"
+                "    sparkey.libsparkey\n"
+                "except sparkey.SparkeyException:\n"
+                "    sys.exit(0)\n"
+                "sys.exit(1)")
+        self.assertEqual(0, _run(code, SPARKEY_LIBRARY="/nonexistent.so"))
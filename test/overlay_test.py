@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sparkey
+import tempfile
+import os
+import unittest
+
+
+class TestOverlay(unittest.TestCase):
+    def setUp(self):
+        self.logfile = tempfile.mkstemp()[1]
+        self.hashfile = tempfile.mkstemp()[1]
+
+    def tearDown(self):
+        os.remove(self.logfile)
+        os.remove(self.hashfile)
+
+    def test_read_your_writes(self):
+        writer = sparkey.HashWriter(self.hashfile, self.logfile,
+                                    overlay_limit=1 << 20)
+        self.assertEqual(None, writer.get('key0'))
+        writer.put('key0', 'value0')
+        writer.put('key1', 'value1')
+        self.assertEqual(b'value0', writer.get('key0'))
+        self.assertTrue(writer.overlay_bytes() > 0)
+
+        writer.flush()
+        self.assertEqual(0, writer.overlay_bytes())
+        self.assertEqual(b'value0', writer['key0'])
+
+        writer.put('key0', 'value2')
+        del writer['key1']
+        self.assertEqual(b'value2', writer.get('key0'))
+        self.assertEqual(None, writer.get('key1'))
+        writer.close()
+
+        reader = sparkey.HashReader(self.hashfile, self.logfile)
+        self.assertEqual(b'value2', reader['key0'])
+        self.assertEqual(None, reader.get('key1'))
+        reader.close()
+
+    def test_limit_flushes(self):
+        writer = sparkey.HashWriter(self.hashfile, self.logfile,
+                                    overlay_limit=1000)
+        for i in range(0, 100):
+            writer.put('key%d' % i, 'value%d' % i)
+        self.assertTrue(writer.overlay_bytes() <= 1000)
+        for i in range(0, 100):
+            self.assertEqual(b'value%d' % i, writer.get('key%d' % i))
+        writer.close()
+
+    def test_flush_async(self):
+        writer = sparkey.HashWriter(self.hashfile, self.logfile,
+                                    overlay_limit=1 << 20)
+        writer.put('key0', 'value0')
+        future = writer.flush_async()
+        writer.put('key1', 'value1')
+        self.assertEqual(b'value0', writer.get('key0'))
+        self.assertEqual(b'value1', writer.get('key1'))
+        future.result()
+        self.assertEqual(b'value0', writer.get('key0'))
+        self.assertEqual(b'value1', writer.get('key1'))
+        writer.close_async().result()
+
+        reader = sparkey.HashReader(self.hashfile, self.logfile)
+        self.assertEqual(2, len(reader))
+        reader.close()
+
+    def test_flush_async_without_overlay(self):
+        writer = sparkey.HashWriter(self.hashfile, self.logfile)
+        writer.put('key0', 'value0')
+        writer.flush_async().result()
+        self.assertEqual(b'value0', writer.get('key0'))
+        writer.put('key0', 'value1')
+        writer.flush_async()
+        writer.flush()
+        self.assertEqual(b'value1', writer.get('key0'))
+        writer.close()
+
+    def test_flush_log(self):
+        writer = sparkey.HashWriter(self.hashfile, self.logfile)
+        writer.put('key0', 'value0')
+        writer.flush_async()
+        writer.put('key1', 'value1')
+        writer.flush_log(fsync=True)
+        with sparkey.LogReader(self.logfile) as log:
+            self.assertEqual([b'key0', b'key1'],
+                             [key for key, _, _ in log])
+        writer.close()
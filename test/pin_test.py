@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sparkey
+from sparkey import pin
+import tempfile
+import os
+import shutil
+import unittest
+
+
+class TestPin(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.hashfile = os.path.join(self.dir, 'test.spi')
+        self.logfile = os.path.join(self.dir, 'test.spl')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_pinned_file(self):
+        path = os.path.join(self.dir, 'data')
+        with open(path, 'wb') as f:
+            f.write(b'x' * 10000)
+        before = pin.locked_bytes()
+        pinned = pin.PinnedFile(path)
+        # Locking may be refused by RLIMIT_MEMLOCK, which is not an error.
+        self.assertEqual(pinned.locked, pinned.error is None)
+        if pinned.locked:
+            self.assertEqual(before + 10000, pin.locked_bytes())
+        self.assertEqual(10000, pinned.info()['bytes'])
+        pinned.close()
+        self.assertFalse(pinned.locked)
+        self.assertEqual(before, pin.locked_bytes())
+
+    def test_missing_file(self):
+        self.assertRaises(OSError, pin.PinnedFile,
+                          os.path.join(self.dir, 'missing'))
+
+    def test_reader(self):
+        writer = sparkey.HashWriter(self.hashfile, self.logfile)
+        for i in range(0, 1000):
+            writer.put('key%d' % i, 'value%d' % i)
+        writer.close()
+
+        reader = sparkey.HashReader(self.hashfile, self.logfile, pin='all')
+        info = reader.pin_info()
+        self.assertEqual([self.hashfile, self.logfile],
+                         [f['path'] for f in info['files']])
+        self.assertEqual(b'value10', reader['key10'])
+        reader.close()
+        self.assertEqual([], reader.pin_info()['files'])
+
+        self.assertRaises(sparkey.SparkeyException, sparkey.HashReader,
+                          self.hashfile, self.logfile, pin='log')
+
+
+if __name__ == '__main__':
+    unittest.main()
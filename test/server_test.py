@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sparkey
+from sparkey.server import Client, Server, decode_response, encode_values
+import tempfile
+import os
+import socket
+import shutil
+import unittest
+
+
+class TestProtocol(unittest.TestCase):
+    def test_values(self):
+        payload = encode_values(7, [b'a', None, b''])[4:]
+        self.assertEqual((7, [b'a', None, b'']), decode_response(payload))
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.socket = os.path.join(self.dir, 'sparkey.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, value):
+        hashfile = os.path.join(self.dir, name + '.spi')
+        logfile = os.path.join(self.dir, name + '.spl')
+        writer = sparkey.HashWriter(hashfile, logfile)
+        for i in range(0, 100):
+            writer.put('key%d' % i, value % i)
+        writer.close()
+        return hashfile, logfile
+
+    def test_lookups(self):
+        server = Server(self.socket, {'t': self._write('gen1', 'a%d')})
+        server.start()
+        client = Client(self.socket, pool_size=2)
+        try:
+            client.ping()
+            self.assertEqual(b'a1', client.get('t', 'key1'))
+            self.assertEqual([b'a0', None, b'a99'],
+                             client.get_many('t', ['key0', 'miss', 'key99']))
+            self.assertEqual([[b'a0'], [b'a1', b'a2']],
+                             client.get_batches('t', [['key0'],
+                                                      ['key1', 'key2']]))
+            self.assertRaises(sparkey.SparkeyException,
+                              client.get, 'unknown', 'key0')
+
+            hashfile, logfile = self._write('gen2', 'b%d')
+            client.load('t', hashfile, logfile)
+            self.assertEqual(b'b1', client.get('t', 'key1'))
+        finally:
+            client.close()
+            server.close()
+
+    def test_error_keeps_connection_in_sync(self):
+        server = Server(self.socket)
+        server.start()
+        client = Client(self.socket, pool_size=1)
+        try:
+            self.assertRaises(sparkey.SparkeyException, client.get_batches,
+                              'missing', [['a'], ['b']])
+            client.ping()
+            client.ping()
+        finally:
+            client.close()
+            server.close()
+
+    def test_refuses_to_remove_other_files(self):
+        with open(self.socket, 'w') as f:
+            f.write('data')
+        self.assertRaises(sparkey.SparkeyException, Server, self.socket)
+        self.assertTrue(os.path.exists(self.socket))
+
+    def test_binds_before_loading(self):
+        # The bind fails before any table is opened, so none can leak.
+        path = os.path.join(self.dir, 'missing', 'sparkey.sock')
+        tables = {'t': (os.path.join(self.dir, 'none.spi'),
+                        os.path.join(self.dir, 'none.spl'))}
+        self.assertRaises(socket.error, Server, path, tables)
+        self.assertRaises(sparkey.SparkeyException, Server, self.socket,
+                          tables)
+        self.assertFalse(os.path.exists(self.socket))
+
+    def test_unload_closes_reader(self):
+        server = Server(self.socket, {'t': self._write('gen1', 'a%d')})
+        reader = server.reader('t')
+        server.load('t', *self._write('gen2', 'b%d'))
+        self.assertRaises(sparkey.SparkeyException, reader.get, 'key1')
+        reader = server.reader('t')
+        server.unload('t')
+        self.assertRaises(sparkey.SparkeyException, reader.get, 'key1')
+        server.close()
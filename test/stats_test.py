@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sparkey
+import sparkey.stats
+import tempfile
+import os
+import unittest
+
+
+class TestHistogram(unittest.TestCase):
+    def test_percentiles(self):
+        h = sparkey.stats.Histogram()
+        self.assertEqual(None, h.percentile(50))
+        for i in range(1, 10001):
+            h.record(i)
+        self.assertEqual(10000, h.count)
+        self.assertEqual(1, h.min)
+        self.assertEqual(10000, h.max)
+        for p in (50, 90, 99):
+            expected = 10000 * p / 100.0
+            self.assertAlmostEqual(expected, h.percentile(p),
+                                   delta=expected / 16)
+        self.assertEqual(10000, h.percentile(100))
+
+    def test_large_values(self):
+        h = sparkey.stats.Histogram()
+        h.record(2 ** 63)
+        self.assertEqual(2 ** 63, h.percentile(50))
+
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        self.logfile = tempfile.mkstemp()[1]
+        self.hashfile = tempfile.mkstemp()[1]
+
+    def tearDown(self):
+        os.remove(self.logfile)
+        os.remove(self.hashfile)
+
+    def test_stats(self):
+        writer = sparkey.HashWriter(self.hashfile, self.logfile, stats=True)
+        for i in range(0, 10):
+            writer.put('key%d' % i, 'value%d' % i)
+        writer.delete('key9')
+        writer.close()
+        stats = writer.stats()
+        self.assertEqual(10, stats['put']['calls'])
+        self.assertEqual(1, stats['delete']['calls'])
+        self.assertEqual(1, stats['flush']['calls'])
+
+        reader = sparkey.HashReader(self.hashfile, self.logfile, stats=True)
+        self.assertEqual(b'value0', reader['key0'])
+        self.assertEqual(None, reader.get('key9'))
+        self.assertTrue(b'key1' in reader)
+        self.assertEqual(9, len(list(reader)))
+        stats = reader.stats()
+        self.assertEqual(2, stats['get']['calls'])
+        self.assertEqual(1, stats['get']['hits'])
+        self.assertEqual(1, stats['get']['misses'])
+        self.assertEqual(6, stats['get']['bytes_read'])
+        self.assertEqual(1, stats['contains']['hits'])
+        self.assertEqual(9, stats['next']['calls'])
+        self.assertEqual(2, stats['get']['latency_us']['count'])
+        reader.close()
+
+    def test_disabled(self):
+        writer = sparkey.LogWriter(self.logfile)
+        self.assertEqual(None, writer.stats())
+        self.assertTrue(type(writer) is sparkey.LogWriter)
+        writer.close()
+
+    def test_exporter(self):
+        stats = sparkey.Stats()
+        exported = []
+        stats.add_exporter(exported.append)
+        writer = sparkey.LogWriter(self.logfile)
+        writer.add_observer(stats)
+        writer.put('key', 'value')
+        writer.remove_observer(stats)
+        writer.put('key', 'value')
+        writer.close()
+        self.assertTrue(type(writer) is sparkey.LogWriter)
+        stats.export(reset=True)
+        self.assertEqual(1, exported[0]['put']['calls'])
+        self.assertEqual({}, stats.snapshot())
@@ -0,0 +1,152 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sparkey
+from sparkey.tiered import TieredStore, _Bloom
+import tempfile
+import os
+import shutil
+import threading
+import unittest
+
+
+class TestBloom(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_bloom(self):
+        bloom = _Bloom.for_keys(1000, 10)
+        for i in range(0, 1000):
+            bloom.add(b'key%d' % i)
+        path = os.path.join(self.dir, 'test.bloom')
+        bloom.save(path)
+        bloom = _Bloom.load(path)
+        for i in range(0, 1000):
+            self.assertTrue(b'key%d' % i in bloom)
+        false_positives = sum(b'other%d' % i in bloom
+                              for i in range(0, 10000))
+        self.assertTrue(false_positives < 300)
+
+
+class TestTieredStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = os.path.join(tempfile.mkdtemp(), 'store')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.dir))
+
+    def open(self, **kwargs):
+        kwargs.setdefault('memtable_limit', 1000)
+        kwargs.setdefault('level0_runs', 2)
+        kwargs.setdefault('fanout', 2)
+        kwargs.setdefault('background', False)
+        return TieredStore(self.dir, **kwargs)
+
+    def test_memtable(self):
+        with self.open() as store:
+            store.put('a', '1')
+            store['b'] = '2'
+            store.delete('a')
+            self.assertEqual(None, store.get('a'))
+            self.assertEqual(b'2', store['b'])
+            self.assertFalse('c' in store)
+            self.assertRaises(KeyError, lambda: store['c'])
+
+    def test_runs_and_compaction(self):
+        with self.open(bloom_bits_per_key=10) as store:
+            for i in range(0, 500):
+                store.put('key%d' % i, 'value%d' % i)
+            for i in range(0, 500, 2):
+                store.delete('key%d' % i)
+            store.put('key0', 'again')
+            store.flush()
+            self.assertTrue(len(store.info()['levels'][0]) > 1)
+            store.compact()
+            levels = store.info()['levels']
+            self.assertTrue(len(levels[0]) < 2)
+            self.assertEqual(b'again', store.get('key0'))
+            self.assertEqual(None, store.get('key2'))
+            self.assertEqual(b'value3', store.get('key3'))
+        # Deletes are dropped from the last level.
+        last = os.path.join(self.dir, [l for l in levels if l][-1][0]['name'])
+        with sparkey.HashReader(last + '.spi', last + '.spl') as reader:
+            self.assertTrue(all(value[:1] == b'\x01' for _, value in reader))
+
+    def test_reopen(self):
+        store = self.open(memtable_limit=100)
+        for i in range(0, 50):
+            store.put('key%d' % i, 'value%d' % i)
+        store.delete('key7')
+        store.close()
+
+        store = self.open(memtable_limit=100)
+        for i in range(0, 50):
+            self.assertEqual(None if i == 7 else b'value%d' % i,
+                             store.get('key%d' % i))
+        store.close()
+        names = [n for n in os.listdir(self.dir) if n.startswith('wal-')]
+        self.assertEqual(1, len(names))
+
+    def test_wal_sync(self):
+        self.assertRaises(sparkey.SparkeyException, self.open,
+                          sync='sometimes')
+        store = self.open()
+        store.put('a', '1')
+        store.delete('b')
+        wal = [n for n in os.listdir(self.dir) if n.startswith('wal-')][0]
+        # Flushed on every write, so readable before the store is closed.
+        with sparkey.LogReader(os.path.join(self.dir, wal)) as log:
+            self.assertEqual([(b'a', b'\x011'), (b'b', b'\x00')],
+                             [(key, value) for key, value, _ in log])
+        store.close()
+
+    def test_background_compaction(self):
+        with self.open(background=True) as store:
+            for i in range(0, 2000):
+                store.put('key%d' % i, 'value%d' % i)
+        with self.open() as store:
+            self.assertEqual(b'value1999', store.get('key1999'))
+
+    def test_concurrent_lookups(self):
+        errors = []
+        with self.open(background=True, sync='fsync') as store:
+            for i in range(0, 500):
+                store.put('key%d' % i, 'value%d' % i)
+
+            def lookup():
+                try:
+                    for _ in range(0, 5):
+                        for i in range(0, 500):
+                            if store.get('key%d' % i) != b'value%d' % i:
+                                errors.append(i)
+                except Exception as e:
+                    errors.append(e)
+            threads = [threading.Thread(target=lookup) for _ in range(0, 4)]
+            for thread in threads:
+                thread.start()
+            for i in range(500, 1500):
+                store.put('key%d' % i, 'value%d' % i)
+            for thread in threads:
+                thread.join()
+        self.assertEqual([], errors)
+
+
+if __name__ == '__main__':
+    unittest.main()
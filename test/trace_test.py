@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sparkey
+from sparkey.trace import Tracer, key_digest, read_trace, replay
+import tempfile
+import os
+import shutil
+import unittest
+
+
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.trace = os.path.join(self.dir, 'lookups.trace')
+        self.hashfile = os.path.join(self.dir, 'store.spi')
+        self.logfile = os.path.join(self.dir, 'store.spl')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_sampling(self):
+        tracer = Tracer(self.trace, sample_rate=0.5, batch_size=3)
+        for i in range(0, 10):
+            tracer.observe('get', b'key%d' % i, b'value', 100)
+        tracer.observe('contains', bytearray(b'key0'), True, 100)
+        tracer.observe('contains', bytearray(b'key1'), False, 100)
+        tracer.observe('next', b'key1', b'value', 100)
+        tracer.close()
+
+        records = list(read_trace(self.trace))
+        self.assertEqual(6, len(records))
+        self.assertEqual(key_digest(b'key1'), records[0].digest)
+        self.assertEqual(5, records[0].value_length)
+        self.assertTrue(records[0].hit)
+        self.assertTrue(records[-1].contains)
+        self.assertFalse(records[-1].hit)
+
+    def test_capture_and_replay(self):
+        writer = sparkey.HashWriter(self.hashfile, self.logfile)
+        for i in range(0, 100):
+            writer.put('key%d' % i, 'value%d' % i)
+        writer.close()
+
+        reader = sparkey.HashReader(self.hashfile, self.logfile)
+        tracer = Tracer(self.trace)
+        reader.add_observer(tracer)
+        for i in range(0, 200, 2):
+            reader.get('key%d' % i)
+        self.assertTrue('key1' in reader)
+        reader.remove_observer(tracer)
+        tracer.close()
+        reader.close()
+
+        result = replay(self.trace, self.hashfile, self.logfile)
+        self.assertEqual(101, result['ops'])
+        self.assertEqual(51, result['hits'])
+        self.assertEqual(51, result['traced_hits'])
+        self.assertEqual(101, result['latency_us']['count'])
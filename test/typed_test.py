@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012-2020 Spotify AB
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sparkey
+import tempfile
+import os
+import unittest
+
+try:
+    import numpy
+    from sparkey.typed import TypedReader, TypedWriter
+except ImportError:
+    numpy = None
+
+DTYPE = [('count', '<i4'), ('score', '<f8')]
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class TestTyped(unittest.TestCase):
+    def setUp(self):
+        self.logfile = tempfile.mkstemp()[1]
+        self.hashfile = tempfile.mkstemp()[1]
+
+    def tearDown(self):
+        os.remove(self.logfile)
+        os.remove(self.hashfile)
+
+    def test_roundtrip(self):
+        keys = numpy.arange(0, 1000, dtype=numpy.int64) * 7
+        records = numpy.zeros(1000, dtype=DTYPE)
+        records['count'] = numpy.arange(1000)
+        records['score'] = numpy.arange(1000) / 2.0
+
+        writer = sparkey.LogWriter(self.logfile)
+        typed = TypedWriter(writer, DTYPE)
+        typed.put_many(keys, records)
+        typed.delete_many(keys[:10])
+        writer.close()
+        sparkey.writehash(self.hashfile, self.logfile)
+
+        reader = sparkey.HashReader(self.hashfile, self.logfile)
+        typed = TypedReader(reader, DTYPE)
+        lookup = numpy.concatenate([keys, [1, 3]])
+        result, found = typed.get_many(lookup)
+        self.assertEqual(1002, len(result))
+        self.assertFalse(found[:10].any())
+        self.assertTrue(found[10:1000].all())
+        self.assertFalse(found[1000:].any())
+        self.assertTrue((result[10:1000] == records[10:]).all())
+        self.assertEqual(None, typed.get(1))
+        self.assertEqual(records[500], typed.get(3500))
+        reader.close()
+
+    def test_wrong_size(self):
+        writer = sparkey.LogWriter(self.logfile)
+        TypedWriter(writer, '<i4').put(1, 5)
+        writer.close()
+        sparkey.writehash(self.hashfile, self.logfile)
+
+        reader = sparkey.HashReader(self.hashfile, self.logfile)
+        self.assertRaises(sparkey.SparkeyException,
+                          TypedReader(reader, DTYPE).get, 1)
+        reader.close()
+
+    def test_stats(self):
+        keys = numpy.arange(0, 10, dtype=numpy.int64)
+        records = numpy.zeros(10, dtype=DTYPE)
+        records['count'] = keys
+
+        writer = sparkey.LogWriter(self.logfile, stats=True)
+        typed = TypedWriter(writer, DTYPE)
+        typed.put_many(keys, records)
+        typed.delete_many(keys[:2])
+        self.assertEqual(10, writer.stats()['put']['calls'])
+        self.assertEqual(2, writer.stats()['delete']['calls'])
+        writer.close()
+        sparkey.writehash(self.hashfile, self.logfile)
+
+        reader = sparkey.HashReader(self.hashfile, self.logfile, stats=True)
+        result, found = TypedReader(reader, DTYPE).get_many(keys)
+        self.assertEqual(10, reader.stats()['get']['calls'])
+        self.assertFalse(found[:2].any())
+        self.assertTrue((result[2:] == records[2:]).all())
+        reader.close()